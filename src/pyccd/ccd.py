@@ -36,6 +36,45 @@ def get_clades(tree: Tree) -> set[frozenset[str]]:
     return clades
 
 
+def _get_leaf_sets(tree: Tree, leafset_cache: dict = None) -> dict[Tree, frozenset[int]]:
+    """
+    Maps every node of a tree to the frozenset of integer leaf labels below it, computed in a
+    single postorder pass on bitmasks of the leaf labels instead of iterating over the leaves of
+    every node.
+
+    Frozensets are only built for masks that are not in the cache yet, i.e. the same clade in
+    different trees shares one frozenset, which lets dictionary lookups succeed on identity.
+
+    :param tree: Tree with integer leaf names
+    :param leafset_cache: Map from bitmask to frozenset, shared between trees
+    :return: map from node to its frozenset of leaf labels
+    """
+    if leafset_cache is None:
+        leafset_cache = {}
+
+    masks = {}
+    leaf_sets = {}
+    for node in tree.traverse("postorder"):
+        if node.children:
+            mask = 0
+            for c in node.children:
+                mask |= masks[c]
+            leafset = leafset_cache.get(mask)
+            if leafset is None:
+                leafset = frozenset().union(*(leaf_sets[c] for c in node.children))
+                leafset_cache[mask] = leafset
+        else:
+            label = int(node.name)
+            mask = 1 << label
+            leafset = leafset_cache.get(mask)
+            if leafset is None:
+                leafset = frozenset({label})
+                leafset_cache[mask] = leafset
+        masks[node] = mask
+        leaf_sets[node] = leafset
+    return leaf_sets
+
+
 def get_maps(trees: list[Tree]) \
         -> tuple[defaultdict[str, int], defaultdict[str, int], dict[int, list]]:
     """
@@ -49,29 +88,32 @@ def get_maps(trees: list[Tree]) \
     uniques = {}
 
     seen = {}
+    # clades shared by the trees, keyed by the bitmask of their leaf labels
+    leafset_cache = {}
 
     for ix, t in enumerate(trees):
-        if not frozenset(sorted(get_clades(t))) in seen:
-            seen[frozenset(sorted(get_clades(t)))] = ix
+        leaf_sets = _get_leaf_sets(t, leafset_cache)
+        # the clades of all inner nodes below the root, the same clades as get_clades(t) would
+        # return but on the integer labels and without writing and parsing the tree
+        tree_clades = frozenset(leafset for node, leafset in leaf_sets.items()
+                                if node.children and node is not t)
+        if not tree_clades in seen:
+            seen[tree_clades] = ix
             uniques[ix] = []
         else:
-            uniques[seen[frozenset(sorted(get_clades(t)))]].append(ix)
+            uniques[seen[tree_clades]].append(ix)
 
         for node in t.traverse("levelorder"):
-            if len(node) > 2:
+            parent_clade = leaf_sets[node]  # the union of the two children's clades
+            if len(parent_clade) > 2:
                 c = node.children
-                c0_leafs = set()
-                for leaf in c[0]:
-                    c0_leafs.add(int(leaf.name))
-                c1_leafs = set()
-                for leaf in c[1]:
-                    c1_leafs.add(int(leaf.name))
-                parent_clade = frozenset(sorted(c0_leafs.union(c1_leafs)))
+                c0_leafs = leaf_sets[c[0]]
+                c1_leafs = leaf_sets[c[1]]
                 m1[parent_clade] += 1
                 if min(c0_leafs) < min(c1_leafs):
-                    m2[(parent_clade, frozenset(c0_leafs))] += 1
+                    m2[(parent_clade, c0_leafs)] += 1
                 else:
-                    m2[(parent_clade, frozenset(c1_leafs))] += 1
+                    m2[(parent_clade, c1_leafs)] += 1
     return m1, m2, uniques
 
 
@@ -87,19 +129,15 @@ def get_tree_probability(tree, m1, m2, use_log=False):
     """
     # getcontext().prec = 20
     probability = 0 if use_log else 1
+    leaf_sets = _get_leaf_sets(tree)
     for node in tree.traverse("levelorder"):
-        if len(node) > 2:
+        if len(leaf_sets[node]) > 2:
             c = node.children
-            c0_leafs = set()
-            for leaf in c[0]:
-                c0_leafs.add(int(leaf.name))
-            c1_leafs = set()
-            for leaf in c[1]:
-                c1_leafs.add(int(leaf.name))
-            parent_clade = frozenset(sorted(c0_leafs.union(c1_leafs)))
+            c0_leafs = leaf_sets[c[0]]
+            c1_leafs = leaf_sets[c[1]]
+            parent_clade = leaf_sets[node]
             if m1[parent_clade] != 0:
-                leaf_set = frozenset(c0_leafs) if min(c0_leafs) < min(c1_leafs) \
-                    else frozenset(c1_leafs)
+                leaf_set = c0_leafs if min(c0_leafs) < min(c1_leafs) else c1_leafs
                 m2_value = m2[(parent_clade, leaf_set)]
                 m1_value = m1[parent_clade]
                 if use_log:
@@ -109,6 +147,19 @@ def get_tree_probability(tree, m1, m2, use_log=False):
     return float(probability)
 
 
+def _get_splits_by_parent(m2) -> dict[frozenset, list]:
+    """
+    Groups the clade splits by their parent clade.
+
+    :param m2: Count of clade splits
+    :return: map from parent clade to its list of (child clade, count) pairs, in the order of m2
+    """
+    splits_by_parent = defaultdict(list)
+    for (parent, child), count in m2.items():
+        splits_by_parent[parent].append((child, count))
+    return splits_by_parent
+
+
 def get_ccd_tree_bottom_up(m1, m2):
     """
     From the maps of clade counts and clade split counts perform a dynamic program to calculate
@@ -122,12 +173,18 @@ def get_ccd_tree_bottom_up(m1, m2):
     # working_list = [([max(m1.keys())], [], 1)]
 
     seen_resolved_clades = {}
+    splits_by_parent = _get_splits_by_parent(m2)
 
     all_clades = sorted(list(m1.keys()), key=len)
     for current_clade in all_clades:
-        for split in [i for i in m2 if i[0] == current_clade]:
+        for child1, split_count in splits_by_parent.get(current_clade, []):
             # this for loop needs to find the best split of the current parent, if any exists!
-            child1 = split[1]
+            split_ccp = split_count / m1[current_clade]
+            if current_clade in seen_resolved_clades \
+                    and split_ccp < seen_resolved_clades[current_clade][0]:
+                # child probabilities are at most 1, this split can neither beat nor tie the best
+                continue
+            split = (current_clade, child1)
             child2 = split[0].difference(split[1])
 
             c1_prob, c2_prob = 0, 0
@@ -152,7 +209,7 @@ def get_ccd_tree_bottom_up(m1, m2):
             # cur_prob = m2[split] / m1[split[0]]  # Prob of current parent, given split
             # best probability of current parent with split
             # split_prob = c1_prob * c2_prob * cur_prob
-            split_prob = c1_prob * c2_prob * (m2[split] / m1[split[0]])
+            split_prob = c1_prob * c2_prob * split_ccp
             # math.isclose instead of == for float comparison 0.1+0.2 != 0.3
             # if math.isclose(split_prob, prob) or split_prob > prob:
             if split[0] in seen_resolved_clades:
@@ -267,6 +324,9 @@ def sample_tree_from_ccd(m1, m2, n=1) -> list[Tree]:
     """
     # sample n trees from the CCD distribution, relative to its clade probabilities in each step
     samples = []
+    splits_by_parent = _get_splits_by_parent(m2)
+    # the choices and their probabilities of each clade, computed when the clade is first sampled
+    clade_choices = {}
 
     for _ in range(n):
         cur_sample = []
@@ -275,12 +335,14 @@ def sample_tree_from_ccd(m1, m2, n=1) -> list[Tree]:
         working_list = [max(m1)]
         while working_list:
             cur_clade = working_list.pop()
-            possible_splits = [(list(i), m2[i]) for i in m2 if list(i)[0] == cur_clade]
-
-            cur_sum = m1[cur_clade]  # same as sum([i[1] for i in next_splits])
-            cur_p = [i[1] / cur_sum for i in possible_splits]
-
-            chosen_split = random.choice([i[0][1] for i in possible_splits], p=cur_p)
+            if cur_clade not in clade_choices:
+                possible_splits = splits_by_parent.get(cur_clade, [])
+                cur_sum = m1[cur_clade]  # same as sum([i[1] for i in next_splits])
+                clade_choices[cur_clade] = ([child for child, _ in possible_splits],
+                                            [count / cur_sum for _, count in possible_splits])
+            choices, cur_p = clade_choices[cur_clade]
+
+            chosen_split = random.choice(choices, p=cur_p)
             remainder_split = cur_clade.difference(chosen_split)
             if len(chosen_split) > 2:
                 working_list.append((chosen_split))
@@ -335,12 +397,12 @@ def calc_entropy(m1, m2):
     :return: Entropy as a float
     """
     h_dict = defaultdict(lambda: 0)
+    splits_by_parent = _get_splits_by_parent(m2)
     for c in sorted(m1.keys(), reverse=False, key=len):
         # iterate over all clades, from small to large
         h_dict[c] = 0
-        c_children = [k for k in m2.keys() if k[0] == c]
-        for _, child in c_children:
-            p = m2[(c, child)] / m1[c]
+        for child, count in splits_by_parent.get(c, []):
+            p = count / m1[c]
             # if len(c) == 3:
             #     # if c has only 3 taxa we don't need to go for childrens entropy
             #     h_dict[c] -= p * np.log(p)
@@ -1,76 +1,138 @@
+import math
 from collections import defaultdict
 
+import numpy as np
+
 from pyccd.tree import Tree
 
-from math import log
+
+def _clade_mask(clade) -> int:
+    """
+    Encode a clade of integer taxa as a bitmask, bit i is set if taxon i is part of the clade.
+
+    :param clade: iterable of integer taxa
+    :return: bitmask of the clade
+    """
+    mask = 0
+    for taxon in clade:
+        mask |= 1 << taxon
+    return mask
+
+
+def _pivot_splits(parent_mask: int, bucket, known_masks, clade_of: dict) -> list[tuple[int, int]]:
+    """
+    Find all splits of a parent clade into two known clades, where the left clade is taken from
+    the bucket of clades sharing the parents pivot.
+
+    :param parent_mask: bitmask of the parent clade
+    :param bucket: clades with the same pivot as the parent, list of ints or uint64 array
+    :param known_masks: sorted uint64 array of all known clades, None if bucket is a list
+    :param clade_of: map from bitmask to known clade
+    :return: list of (left_mask, right_mask) splits
+    """
+    if known_masks is None:
+        return [(left_mask, parent_mask ^ left_mask) for left_mask in bucket
+                if left_mask != parent_mask and left_mask & parent_mask == left_mask
+                and parent_mask ^ left_mask in clade_of]
+    parent = np.uint64(parent_mask)
+    left = bucket[((bucket & parent) == bucket) & (bucket != parent)]
+    right = left ^ parent
+    pos = np.minimum(np.searchsorted(known_masks, right), len(known_masks) - 1)
+    found = known_masks[pos] == right
+    return list(zip(left[found].tolist(), right[found].tolist()))
 
 
 def expand(observed_clades, observed_clade_splits):
     expanded_clade_partitions = defaultdict(set)
 
+    # all set operations are done on bitmasks, the lowest set bit (m & -m) is the smallest taxon
+    mask_of = {c: _clade_mask(c) for c in observed_clades}
+    clade_of = {m: c for c, m in mask_of.items()}
+
     for clade, splits in observed_clade_splits.items():
         for left, right in splits:
-            if min(left) < min(right):
+            left_mask, right_mask = mask_of[left], mask_of[right]
+            if (left_mask & -left_mask) < (right_mask & -right_mask):
                 expanded_clade_partitions[clade].add((left, right))
             else:
                 expanded_clade_partitions[clade].add((right, left))
 
-    clade_buckets = defaultdict(set)
-    for c in observed_clades:
-        clade_buckets[len(c)].add(c)
+    # bucket clades by their pivot, the smallest leaf, so that for a parent clade only
+    # candidate left clades sharing the parents pivot have to be checked
+    by_pivot = defaultdict(list)
+    for m in clade_of:
+        by_pivot[m & -m].append(m)
+
+    known_masks = None
+    if clade_of and max(clade_of).bit_length() <= 64:
+        # contiguous uint64 buckets allow a vectorised subset test per parent clade
+        known_masks = np.sort(np.fromiter(clade_of, dtype=np.uint64, count=len(clade_of)))
+        by_pivot = {p: np.array(masks, dtype=np.uint64) for p, masks in by_pivot.items()}
 
-    for clade in observed_clades:
-        n = len(clade)
-        if n <= 2:
+    for clade, parent_mask in mask_of.items():
+        if len(clade) <= 2:
             continue  # skip leaves and cherries
 
-        existing_splits = set(expanded_clade_partitions.get(clade, set()))
-        # clade_list = sorted(clade)
-
-        # consider only left sizes from 1 to n//2
-        for left_size in range(1, n // 2 + 1):
-            for left in clade_buckets[left_size]:
-                if left.issubset(clade):
-                    right = clade - left
-                    if right in clade_buckets[len(right)]:
-                        # canonical ordering
-                        l, r = (left, right) if min(left) < min(right) else (right, left)
-                        split = (l, r)
-                        if split not in existing_splits:
-                            expanded_clade_partitions[clade].add(split)
-                            # print(f"Found new split for {clade}: {split}")
+        existing_splits = expanded_clade_partitions[clade]
+        for left_mask, right_mask in _pivot_splits(parent_mask,
+                                                   by_pivot[parent_mask & -parent_mask],
+                                                   known_masks, clade_of):
+            # left always contains the pivot, i.e. the split is already in canonical ordering
+            existing_splits.add((clade_of[left_mask], clade_of[right_mask]))
 
     return expanded_clade_partitions
 
 
+def annotate_ids(tree: Tree) -> None:
+    """
+    Attach the integer taxon id of every leaf as attribute _id, so that hot loops don't have to
+    convert the leaf name again for every clade the leaf is part of.
+
+    :param tree: input tree with integer leaf names
+    """
+    for leaf in tree.iter_leaves():
+        leaf._id = int(leaf.name)
+
+
 def get_maps_full(trees: list[Tree]) \
-        -> tuple[defaultdict[str, int], defaultdict[str, int], dict[int, list]]:
+        -> tuple[defaultdict[str, int], defaultdict[str, int], list[list[tuple]]]:
     """
     From a list of trees, return relevant CCD maps from clades/clade splits to counts.
 
     :param trees: list of input trees
-    :return: maps for CCDs, clades to occurrences (m1), clades to clade splits (m2), unique trees
+    :return: maps for CCDs, clades to occurrences (m1), clades to clade splits (m2) and per tree
+             the (parent, left, right) splits of all non-cherry clades, left holding the smallest
+             taxon
     """
     m1 = defaultdict(int)  # map for each clade how often it got sampled
     m2 = defaultdict(int)  # map for each (c1,c2) clade how often this specific relation got sampled
     # uniques = {}
 
     seen = {}
+    per_tree_splits = []
 
     for ix, t in enumerate(trees):
+        annotate_ids(t)
         # if not frozenset(sorted(get_clades(t))) in seen:
         #     seen[frozenset(sorted(get_clades(t)))] = ix
         #     uniques[ix] = []
         # else:
         #     uniques[seen[frozenset(sorted(get_clades(t)))]].append(ix)
 
+        tree_splits = []
         for node in t.traverse("levelorder"):
-            parent_clade = frozenset(int(leaf.name) for leaf in node)
+            parent_clade = frozenset(leaf._id for leaf in node)
             m1[parent_clade] += 1
             if node.children:
-                child0_clade = frozenset(sorted(int(leaf.name) for leaf in node.children[0]))
-                child1_clade = frozenset(sorted(int(leaf.name) for leaf in node.children[1]))
+                child0_clade = frozenset(leaf._id for leaf in node.children[0])
+                child1_clade = frozenset(leaf._id for leaf in node.children[1])
                 m2[(parent_clade, child0_clade, child1_clade)] += 1
+                if len(parent_clade) > 2:
+                    if min(child0_clade) < min(child1_clade):
+                        tree_splits.append((parent_clade, child0_clade, child1_clade))
+                    else:
+                        tree_splits.append((parent_clade, child1_clade, child0_clade))
+        per_tree_splits.append(tree_splits)
             # if len(node) > 2:
             #     c = node.children
             #     c0_leafs = set()
@@ -85,13 +147,39 @@ def get_maps_full(trees: list[Tree]) \
             #         m2[(parent_clade, frozenset(c0_leafs))] += 1
             #     else:
             #         m2[(parent_clade, frozenset(c1_leafs))] += 1
-    return m1, m2
+    return m1, m2, per_tree_splits
 
 
-def get_ccd0(trees):
+def get_tree_probabilities(offsets: np.ndarray, ids: np.ndarray, ccp_values: np.ndarray,
+                           use_log: bool = False) -> np.ndarray:
+    """
+    Computes the probabilities of many trees at once from the conditional clade probabilities
+    of their splits.
+
+    The probabilities are exp of the summed log ccps, which is not bit identical to multiplying
+    the ccps of a tree, results differ by up to about 1e-14 relative. Compare them with a
+    tolerance.
+
+    :param offsets: Array of length n_trees + 1, the splits of tree i are
+                    ids[offsets[i]:offsets[i + 1]]
+    :param ids: Indices into ccp_values for the splits of all trees
+    :param ccp_values: Conditional clade probability of each split
+    :param use_log: Whether to return log probabilities
+    :return: Array with the (log) probability of each tree
+    """
+    with np.errstate(divide="ignore"):
+        log_ccp = np.log(ccp_values)
+    tree_of_split = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    log_probs = np.bincount(tree_of_split, weights=log_ccp[ids], minlength=len(offsets) - 1)
+    if use_log:
+        return log_probs
+    return np.exp(log_probs)
+
+
+def get_ccd0(trees, verbose=False):
     n_trees = len(trees)
 
-    m1, m2 = get_maps_full(trees)
+    m1, m2, per_tree_splits = get_maps_full(trees)
 
     clade_credibility = {clade: count / n_trees for clade, count in m1.items()}  # converting m1
 
@@ -105,6 +193,8 @@ def get_ccd0(trees):
     clade_partitions = expanded_test
 
     ccd0_probabilities = {}
+    # the root clade contains all taxa, i.e. it is the largest clade
+    root_clade = max(m1.keys(), key=len)
 
     def recursive_prob_computer(clade):
         nonlocal ccd0_probabilities
@@ -159,7 +249,6 @@ def get_ccd0(trees):
         # print(f"    Clade: {sorted(clade)} CCD0 Probability: {clade_prob}")
 
         child_probabilities = defaultdict(float)
-        root_clade = max(m1.keys())
         child_probabilities[root_clade] = 1.0  # root probability starts at 1
 
         from collections import deque
@@ -196,36 +285,38 @@ def get_ccd0(trees):
     # ]
     # sorted_mismatches = sorted(mismatches, key=lambda x: len(x[0]))
 
-    def get_tree_probability(tree, partitions_ccp, use_log=False):
-        prob = 0.0 if use_log else 1
-        for node in tree.traverse("levelorder"):
-            if len(node) > 2:
-                # Cherry or bigger
-                left_clade = frozenset(sorted(int(leaf.name) for leaf in node.children[0]))
-                right_clade = frozenset(sorted(int(leaf.name) for leaf in node.children[1]))
-                split = (left_clade, right_clade) if min(left_clade) < min(right_clade) \
-                    else (right_clade, left_clade)
-                parent_clade = left_clade | right_clade
-                ccp = partitions_ccp.get(parent_clade, {}).get(split, 0.0)
-                if ccp == 0.0:
-                    prob = float("-inf") if use_log else 0.0
-                    break
-                if use_log:
-                    prob += log(ccp)
-                else:
-                    prob *= ccp
-        return float(prob)
-
-    python_probs = {}
-    for i, t in enumerate(trees):
-        python_probs[i] = get_tree_probability(t, partitions_ccp)
-        print(f"tree {i}: {python_probs[i]}")
+    # flat table of all conditional clade probabilities, the last entry is used for splits
+    # that are not part of the CCD0
+    split_index = {}
+    ccp_values = []
+    for parent_clade, splits in partitions_ccp.items():
+        for split, ccp in splits.items():
+            split_index[(parent_clade, split)] = len(ccp_values)
+            ccp_values.append(ccp)
+    missing_split = len(ccp_values)
+    ccp_values.append(0.0)
+
+    # CSR style layout, the split ids of tree i are ids[offsets[i]:offsets[i + 1]]
+    offsets = [0]
+    ids = []
+    for tree_splits in per_tree_splits:
+        for parent_clade, left_clade, right_clade in tree_splits:
+            ids.append(split_index.get((parent_clade, (left_clade, right_clade)), missing_split))
+        offsets.append(len(ids))
+
+    tree_probs = get_tree_probabilities(np.array(offsets, dtype=np.int64),
+                                        np.array(ids, dtype=np.int64),
+                                        np.array(ccp_values))
+    python_probs = {i: float(prob) for i, prob in enumerate(tree_probs)}
+    if verbose:
+        print("\n".join(f"tree {i}: {prob}" for i, prob in python_probs.items()))
     print("Look for mismatches between java and python....")
     prob_problem = []
     for k in python_probs.keys():
         v1 = python_probs[k]
         v2 = java_tree_probs[k]
-        if abs(v1 - v2) > tolerance:
+        # tree probabilities are only equal up to rounding, see get_tree_probabilities
+        if not math.isclose(v1, v2, rel_tol=tolerance, abs_tol=tolerance):
             prob_problem.append((k, v1, v2))
     print(prob_problem)
 
@@ -233,6 +324,8 @@ def get_ccd0(trees):
 if __name__ == '__main__':
     from pathlib import Path
 
+    data_dir = Path(__file__).parent.absolute().parent.parent / "tests" / "data"
+
     # java_output = {}
     # with open(f"{Path(__file__).parent.absolute().parent.parent}/tests/data/java_out.txt") as f:
     #     for line in f:
@@ -245,7 +338,7 @@ if __name__ == '__main__':
     #         java_output[clade] = float(prob_str)
 
     java_tree_probs = {}
-    with open(f"{Path(__file__).parent.absolute().parent.parent}/tests/data/java_probs.out") as f:
+    with open(data_dir / "java_probs.out") as f:
         for line in f:
             if not line.startswith("Tree "):
                 continue
@@ -255,7 +348,7 @@ if __name__ == '__main__':
 
     from pyccd.read_nexus import read_nexus_trees
 
-    tree_file = f"{Path(__file__).parent.absolute().parent.parent}/tests/data/30Taxa.trees"
+    tree_file = str(data_dir / "30Taxa.trees")
     trees = read_nexus_trees(tree_file, breath_trees=False, label_transm_history=False)
     # trees = trees[int(len(trees)*0.1):]
-    get_ccd0(trees)
+    get_ccd0(trees, verbose=True)
@@ -4,6 +4,23 @@ trees and transmission CCDs.
 """
 
 
+def get_root_distances(root_node) -> dict:
+    """
+    Computes the distance to the root for every node of a tree in a single preorder pass.
+
+    :param root_node: The root node object of a tree (tree.get_tree_root())
+    :return: Dictionary mapping id(node) to the distance of node to the root
+    """
+    root_dist = {}
+    stack = [(root_node, 0.0)]
+    while stack:
+        node, dist = stack.pop()
+        root_dist[id(node)] = dist
+        for child in node.children:
+            stack.append((child, dist + child.dist))
+    return root_dist
+
+
 def find_infector(node, indirect: bool = False):
     """
     Takes a node in a transmission annotated phylogenetic tree and returns its infector.
@@ -12,13 +29,16 @@ def find_infector(node, indirect: bool = False):
     :param node: Node of which to find the infector.
     :return: Infector of node
     """
-    if node.name != node.transm_ancest:
-        if not (indirect and node.transm_ancest.startswith("Unknown")):
-            return node.transm_ancest
+    name = node.name
+    transm_ancest = node.transm_ancest
+    if name != transm_ancest:
+        if not (indirect and transm_ancest.startswith("Unknown")):
+            return transm_ancest
     parent = node.up
-    while (parent.transm_ancest == node.name or
+    # walking up while the node's own lineage continues, the root has no parent
+    while (parent.transm_ancest == name or
            (indirect and parent.transm_ancest.startswith("Unknown"))):
-        if parent.is_root():
+        if parent.up is None:
             break
         parent = parent.up
     if indirect and (not parent.is_root()) and parent.transm_ancest.startswith("Unknown"):
@@ -26,21 +46,29 @@ def find_infector(node, indirect: bool = False):
     return parent.transm_ancest
 
 
-def find_infector_with_data(node, root_node, indirect: bool = False):
+def find_infector_with_data(node, root_node=None, indirect: bool = False, *,
+                            root_dist: dict = None):
     """
     Finds the infector with extra data: distance to root of start and end of infection
 
     :param node: The node to find the infector of, in this case assumes to be a leaf
-    :param root_node: The root node object of a tree (tree.get_tree_root())
+    :param root_node: The root node object of a tree (tree.get_tree_root()), only used to compute
+                      root_dist if that is not given, defaults to the root of node's tree
     :param indirect: Currently not supported?
+    :param root_dist: Distances to the root keyed by id(node), see :func:`get_root_distances`,
+                      pass it when calling this for many nodes of the same tree
     :return:
     """
-    if node.name != node.transm_ancest:
+    if root_dist is None:
+        root_dist = get_root_distances(root_node if root_node is not None
+                                       else node.get_tree_root())
+    name = node.name
+    if name != node.transm_ancest:
         if not (indirect and node.transm_ancest.startswith("Unknown")):
             # regular infection from one taxon to the next or Unknown/Block
 
-            # node_root_dist = node.get_distance(root_node)
-            parent_root_dist = node.up.get_distance(root_node)
+            # node_root_dist = root_dist[id(node)]
+            parent_root_dist = root_dist[id(node.up)]
             # Using block end due to blocks, if no block this is the same as start
             event_length_from_parent = node.dist * node.blockend
 
@@ -48,27 +76,28 @@ def find_infector_with_data(node, root_node, indirect: bool = False):
 
             if node.blockcount > 0:
                 block_name = f"block_{node.name}"
-                data = [
+                data = (
                     block_name,
                     node.name,
                     infection_start_dist_root,
                     None,
-                ]
+                )
             else:
-                data = [
+                data = (
                     node.transm_ancest,
                     node.name,
                     infection_start_dist_root,
                     None
-                ]
+                )
             unknown_out_node = None
             if node.transm_ancest.startswith("Unknown"):
                 unknown_out_node = node
             return node.transm_ancest, [data], unknown_out_node
     parent = node.up
-    while (parent.transm_ancest == node.name or
+    # walking up while the node's own lineage continues, the root has no parent
+    while (parent.transm_ancest == name or
            (indirect and parent.transm_ancest.startswith("Unknown"))):
-        if parent.is_root():
+        if parent.up is None:
             break
         parent = parent.up
     if indirect and (not parent.is_root()) and parent.transm_ancest.startswith("Unknown"):
@@ -77,52 +106,74 @@ def find_infector_with_data(node, root_node, indirect: bool = False):
         # parent is the root is the leaf, og infection
         assert node.name == parent.transm_ancest, "The parent is the root and node.name is OG?"
         assert node.blockcount == -1, "Something wrong?"
-        data = [
+        data = (
             parent.transm_ancest,
             node.name,
             0.0,
             None,
-        ]
+        )
         return parent.transm_ancest, [data], None
     # assert parent.blockstart == parent.blockend, "Assuming this is one infection atm!"
-    # node_root_dist = node.get_distance(root_node)  # assumes node is a leaf!
+    # node_root_dist = root_dist[id(node)]  # assumes node is a leaf!
     # blockend so that if its a block we have the correct start...
     length_to_add_from_cur_edge = parent.dist * parent.blockend
-    infection_start_dist_root = parent.up.get_distance(root_node) + length_to_add_from_cur_edge
+    infection_start_dist_root = root_dist[id(parent.up)] + length_to_add_from_cur_edge
     if parent.blockcount > 0:
         block_name = f"block_{node.name}"
-        data = [
+        data = (
             block_name,
             node.name,
             infection_start_dist_root,
             None,
-        ]
+        )
     else:
-        data = [
+        data = (
             parent.transm_ancest,
             node.name,
             infection_start_dist_root,
             None,
-        ]
+        )
     unknown_out_node = None
     if parent.transm_ancest.startswith("Unknown"):
         unknown_out_node = parent
     return parent.transm_ancest, [data], unknown_out_node
 
 
-def find_infector_unknown(cur_u_node, root_node):
+def find_infector_unknown(cur_u_node, root_node=None, *, root_dist: dict = None):
     """
     Finds the infector of nodes that are unknown, not leafs
 
     :param cur_u_node: A node whose transm_ancest is unknown
-    :param root_node: The root node of a tree (tree.get_tree_root())
+    :param root_node: The root node of a tree (tree.get_tree_root()), only used to compute
+                      root_dist if that is not given, defaults to the root of cur_u_node's tree
+    :param root_dist: Distances to the root keyed by id(node), see :func:`get_root_distances`,
+                      pass it when calling this for many nodes of the same tree
     :return:
     """
+    if root_dist is None:
+        root_dist = get_root_distances(root_node if root_node is not None
+                                       else cur_u_node.get_tree_root())
+    result = []
+    # walking up the chain of unknown ancestors
+    while cur_u_node is not None:
+        data, cur_u_node = _find_infector_unknown_step(cur_u_node, root_dist)
+        result.extend(data)
+    return result
+
+
+def _find_infector_unknown_step(cur_u_node, root_dist):
+    """
+    Finds the infection events of a single unknown node, see :func:`find_infector_unknown`
+
+    :param cur_u_node: A node whose transm_ancest is unknown
+    :param root_dist: Distances to the root keyed by id(node), see :func:`get_root_distances`
+    :return: The events and the next unknown node up the tree, None if there is none
+    """
     if cur_u_node.transm_ancest != cur_u_node.up.transm_ancest:
         if cur_u_node.up.is_root():
             parent_root_dist = 0.0
         else:
-            parent_root_dist = cur_u_node.up.up.get_distance(root_node)
+            parent_root_dist = root_dist[id(cur_u_node.up.up)]
 
         event_start_length_from_parent = cur_u_node.up.dist * cur_u_node.up.blockend
         infection_start_dist_root = parent_root_dist + event_start_length_from_parent
@@ -140,72 +191,72 @@ def find_infector_unknown(cur_u_node, root_node):
                                                                         cur_u_node.up.blockend)
 
                     data = [
-                        [
+                        (
                             f"Unknown-block_{cur_u_node.up.name}",
                             f"Unknown_{cur_u_node.up.name}",
                             infection_block_unknown_start,
                             None
-                        ],
-                        [
+                        ),
+                        (
                             f"Unknown_{cur_u_node.up.name}",
                             block_name,
                             infection_start_dist_root,
                             cur_u_node.blockcount
-                        ]
+                        )
                     ]
                 else:
                     # infecting a block from a block with a sibling having some label we know that
                     # the sibling sample persists and infects this block
-                    data = [
+                    data = (
                         node_sibling.transm_ancest,
                         block_name,
                         infection_start_dist_root,
                         cur_u_node.blockcount,
-                    ]
+                    )
             else:
-                data = [
+                data = (
                     cur_u_node.up.transm_ancest,
                     block_name,
                     infection_start_dist_root,
                     cur_u_node.blockcount,
-                ]
+                )
         else:
             if cur_u_node.up.blockcount > 0:
                 block_name = f"block_{cur_u_node.up.name}"
-                data = [
+                data = (
                     block_name,
                     cur_u_node.transm_ancest,
                     infection_start_dist_root,
                     None,
-                ]
+                )
             else:
-                data = [
+                data = (
                     cur_u_node.up.transm_ancest,
                     cur_u_node.transm_ancest,
                     infection_start_dist_root,
                     None,
-                ]
-        result = data if isinstance(data[0], list) else [data]
+                )
+        result = data if isinstance(data, list) else [data]
         if cur_u_node.up.transm_ancest.startswith("Unknown"):
             if not cur_u_node.up.is_root():
-                more_data = find_infector_unknown(cur_u_node.up, root_node)
-                result.extend(more_data)
-        return result
+                return result, cur_u_node.up
+        return result, None
     parent = cur_u_node.up
-    while parent.transm_ancest == cur_u_node.transm_ancest:
-        if parent.is_root():
+    transm_ancest = cur_u_node.transm_ancest
+    while parent.transm_ancest == transm_ancest:
+        if parent.up is None:
             break
         parent = parent.up
     if parent.is_root():
-        data = [
+        data = (
             parent.transm_ancest,
             cur_u_node.transm_ancest,
             0.0,
             None,
-        ]
-        return [data]
+        )
+        return [data], None
 
-    dist_start_infection_to_root = (parent.up.get_distance(root_node) +
+    dist_start_infection_to_root = (root_dist[id(parent.up)] +
                                     (parent.dist * parent.blockend))
 
     if cur_u_node.blockcount > 0:
@@ -214,54 +265,53 @@ def find_infector_unknown(cur_u_node, root_node):
             node_sibling = next(x for x in cur_u_node.up.children if x != cur_u_node)
             if node_sibling.blockcount > 0:
                 # Block can not infect a block directly
-                infection_block_unknown_start = (parent.up.get_distance(root_node)
+                infection_block_unknown_start = (root_dist[id(parent.up)]
                                                  + (parent.dist * parent.blockend))
                 data = [
-                    [
+                    (
                         f"Unknown-block_{parent.name}",
                         f"Unknown_{parent.name}",
                         infection_block_unknown_start,
                         None,
-                    ],
-                    [
+                    ),
+                    (
                         f"Unknown_{parent.name}",
                         block_name,
                         dist_start_infection_to_root,
                         cur_u_node.blockcount,
-                    ]
+                    )
                 ]
             else:
-                data = [
+                data = (
                     node_sibling.transm_ancest,
                     block_name,
                     dist_start_infection_to_root,
                     cur_u_node.blockcount,
-                ]
+                )
         else:
-            data = [
+            data = (
                 parent.transm_ancest,
                 block_name,
                 dist_start_infection_to_root,
                 cur_u_node.blockcount
-            ]
+            )
     else:
         if parent.blockcount > 0:
             block_name = f"block_{parent.name}"
-            data = [
+            data = (
                 block_name,
                 cur_u_node.transm_ancest,
                 dist_start_infection_to_root,
                 None
-            ]
+            )
         else:
-            data = [
+            data = (
                 parent.transm_ancest,
                 cur_u_node.transm_ancest,
                 dist_start_infection_to_root,
                 None
-            ]
-    result = data if isinstance(data[0], list) else [data]
+            )
+    result = data if isinstance(data, list) else [data]
     if parent.transm_ancest.startswith("Unknown"):
-        more_data = find_infector_unknown(parent, root_node)
-        result.extend(more_data)
-    return result
+        return result, parent
+    return result, None
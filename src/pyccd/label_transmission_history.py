@@ -6,8 +6,9 @@ It traverses the tree and assigns labels to nodes where blockcounts
 indicate unknown transmission ancestry. Unlabeled nodes are tracked
 for further processing.
 """
-import collections
-from typing import List, Tuple, Any
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
 
 from .tree import Tree
 
@@ -25,39 +26,45 @@ def label_transmission_tree(tree):
 
     unknown_count = 0
 
-    unlabeled_nodes_list = []
-    top_infected_nodes_list = collections.deque([])  # more efficient than list
+    # dict used as an insertion ordered set, O(1) membership tests and removals
+    unlabeled_nodes_list = {}
+    top_infected_nodes_list = []  # only used as a LIFO stack (append/pop)
 
-    # Loops over all nodes first, could probably be done more efficiently in the future
+    # The tree is walked once, both passes below work on the flattened nodes
+    flat_tree = _flatten_tree(tree)
+    # every unknown label is given to at least one node, i.e. there are at most as many as nodes
+    unknown_labels = [f"Unknown-{k}" for k in range(len(flat_tree[0]))]
     unlabeled_nodes_list, unknown_count = _label_all_nodes(
-        tree, unlabeled_nodes_list, unknown_count
+        tree, unlabeled_nodes_list, unknown_count, flat_tree, unknown_labels
     )
 
     unlabeled_nodes_list, top_infected_nodes_list = (
-        _label_leaf_and_reachable_nodes(tree, unlabeled_nodes_list, top_infected_nodes_list)
+        _label_leaf_and_reachable_nodes(flat_tree[-1], unlabeled_nodes_list,
+                                        top_infected_nodes_list)
     )
 
     unlabeled_nodes_list, unknown_count = _label_top_infected_nodes(top_infected_nodes_list,
                                                                     unlabeled_nodes_list,
-                                                                    unknown_count)
+                                                                    unknown_count,
+                                                                    unknown_labels)
 
     if len(unlabeled_nodes_list) == 0:
         tree.get_tree_root().add_feature("num_unknowns", unknown_count)
         return
 
-    # Sorting the list of unlabeled nodes by their level for _label_all_remaining_unknowns()
-    unlabeled_nodes_list.sort(
-        key=lambda obj: obj.get_distance(tree.get_tree_root(), topology_only=True))
-    _label_all_remaining_unknowns(unlabeled_nodes_list, unknown_count)
+    # Unlabeled nodes in levelorder, i.e. sorted by their level for _label_all_remaining_unknowns()
+    unlabeled_nodes_list = [node for node in flat_tree[0] if node in unlabeled_nodes_list]
+    unknown_count = _label_all_remaining_unknowns(unlabeled_nodes_list, unknown_count,
+                                                  unknown_labels)
     tree.get_tree_root().add_feature("num_unknowns", unknown_count)
 
 
-def _label_leaf_and_reachable_nodes(tree, unlabeled_nodes_list, top_infected_nodes_list):
+def _label_leaf_and_reachable_nodes(leaves, unlabeled_nodes_list, top_infected_nodes_list):
     """
         Labels all leaf nodes and recursively propagates the
         transmission ancestry to all reachable nodes.
 
-        This function processes all the leaves in the provided tree (tree).
+        This function processes all the provided leaves (leaves).
         For each leaf node:
 
         - If the blockcount is -1 (indicating no transmission event),
@@ -68,102 +75,176 @@ def _label_leaf_and_reachable_nodes(tree, unlabeled_nodes_list, top_infected_nod
         The function modifies the tree by adding the transmission ancestry feature to nodes and
         updates the `unlabeled_nodes_list` by removing nodes that have been labeled.
 
-        :param tree: The tree to be processed (should contain leaf nodes with `blockcount`).
-        :param unlabeled_nodes_list: List of nodes that have not yet been labeled
+        :param leaves: The leaves to be processed in tree order (leaf nodes with `blockcount`),
+                       iterating over the tree itself yields them as well.
+        :param unlabeled_nodes_list: Ordered set (dict) of nodes that have not yet been labeled
                                      with transmission ancestry.
         :param top_infected_nodes_list: List of nodes that are considered top-infected nodes,
                                         which are infected by transmission propagation.
         :returns: The updated `unlabeled_nodes_list` and `top_infected_nodes_list` after
                   propagation.
         """
+    # worklist and its queued set are shared between all leaves, both are empty after a leaf
+    working_node_list = []
+    queued = set()
+
     # First label all leafs and reachable nodes from leaves
-    # todo too many nested blocks here, abstract and pull out into functions.
-    for leaf in tree:
+    for leaf in leaves:
         if leaf.blockcount == -1:
             # No transmission event towards the current node,
-            # recursively label all the nodes reachable from here
+            # label all the nodes reachable from here
             leaf.transm_ancest = leaf.name
-            if leaf in unlabeled_nodes_list:
-                unlabeled_nodes_list.remove(leaf)
-            working_node_list = [leaf.up]
-
-            while working_node_list:
-                working_node = working_node_list.pop()
-                if working_node.blockcount == -1:  # and not working_node.is_root():
-                    # There is no event towards current node
-                    working_node.transm_ancest = leaf.name  # label the current node
-                    if working_node in unlabeled_nodes_list:
-                        unlabeled_nodes_list.remove(working_node)
-                    # if the current node is not the root we can look further up
-                    if working_node.up:
-                        if not hasattr(working_node.up, "transm_ancest"):
-                            # if the node upwards has not been labeled
-                            # we can check if we need to add it
-                            if working_node.up not in working_node_list:
-                                working_node_list.append(working_node.up)
-                # If working_node has children we need to sort those out too
-                if len(working_node.children) > 0:
-                    assert len(working_node.children) == 2, "Non binary tree found, not supported!"
-                    for c in working_node.children:
-                        # adding the children that can be reached from current node
-                        if not hasattr(c, "transm_ancest"):
-                            if c.blockcount == -1:
-                                # adding the children that are reachable
-                                # but have not been labeled yet
-                                if c not in working_node_list:
-                                    working_node_list.append(c)
-                            elif c.blockcount == 0:
-                                # child that is infected by current label
-                                c.transm_ancest = leaf.name
-                                top_infected_nodes_list.append(c)
-                                if c in unlabeled_nodes_list:
-                                    # Removing the child c from unlabeled list
-                                    unlabeled_nodes_list.remove(c)
-        elif (leaf.blockcount == 0 and
-              leaf not in top_infected_nodes_list and
-              leaf not in unlabeled_nodes_list):
-            unlabeled_nodes_list.append(leaf)
+            unlabeled_nodes_list.pop(leaf, None)
+            _propagate_leaf_label(leaf, unlabeled_nodes_list, top_infected_nodes_list,
+                                  working_node_list, queued)
+        elif leaf.blockcount == 0 and leaf.transm_ancest is None:
+            # labeled leaves with a blockcount of 0 are exactly the ones in top_infected_nodes_list,
+            # setdefault keeps the position of a leaf that is already in the unlabeled nodes
+            unlabeled_nodes_list.setdefault(leaf)
     return unlabeled_nodes_list, top_infected_nodes_list
 
 
-def _label_all_nodes(tree: Tree, unlabeled_nodes_list: List = None,
-                     unknown_count: int = 0) \
+def _propagate_leaf_label(leaf, unlabeled_nodes_list, top_infected_nodes_list,
+                          working_node_list, queued) -> None:
+    """
+    Propagates the label of a leaf with blockcount -1 to all nodes reachable without passing a
+    transmission event. Each node is put on the working list at most once, nodes that are
+    already labeled are not visited again, i.e. the total work over all leaves is linear in the
+    number of nodes.
+
+    :param leaf: The labeled leaf node with a blockcount of -1.
+    :param unlabeled_nodes_list: Ordered set (dict) of nodes that have not yet been labeled
+                                 with transmission ancestry.
+    :param top_infected_nodes_list: List of nodes that are considered top-infected nodes,
+                                    newly infected children are appended.
+    :param working_node_list: Empty list that is reused as the working list.
+    :param queued: Set that is reused to keep track of the nodes that have been put on the
+                   working list, avoids scanning the list itself.
+    """
+    label = leaf.name
+    queued.clear()
+    queued.add(leaf.up)
+    working_node_list.append(leaf.up)
+    # bound methods as locals, saves the attribute lookups in the loop below
+    push, pop, mark = working_node_list.append, working_node_list.pop, queued.add
+    unlabeled_pop, infected_push = unlabeled_nodes_list.pop, top_infected_nodes_list.append
+
+    while working_node_list:
+        working_node = pop()
+        if working_node.blockcount == -1:  # and not working_node.is_root():
+            # There is no event towards current node
+            working_node.transm_ancest = label  # label the current node
+            unlabeled_pop(working_node, None)
+            # if the current node is not the root we can look further up
+            # if the node upwards has not been labeled we can check if we need to add it
+            up = working_node.up
+            if up and up.transm_ancest is None and up not in queued:
+                mark(up)
+                push(up)
+        # If working_node has children we need to sort those out too
+        children = working_node.children
+        if children:
+            assert len(children) == 2, "Non binary tree found, not supported!"
+            for c in children:
+                # adding the children that can be reached from current node
+                if c.transm_ancest is not None:
+                    continue
+                if c.blockcount == -1:
+                    # adding the children that are reachable but have not been labeled yet
+                    if c not in queued:
+                        mark(c)
+                        push(c)
+                elif c.blockcount == 0:
+                    # child that is infected by current label
+                    c.transm_ancest = label
+                    infected_push(c)
+                    # Removing the child c from unlabeled list
+                    unlabeled_pop(c, None)
+
+
+def _label_all_nodes(tree: Tree, unlabeled_nodes_list: Dict = None,
+                     unknown_count: int = 0, flat_tree: Tuple = None,
+                     unknown_labels: List[str] = None) \
         -> \
-                Tuple[List, int]:
+                Tuple[Dict, int]:
     """
     Labels all nodes by iterating over the entire tree.
 
     :param tree: The tree to label.
-    :param unlabeled_nodes_list: List of unlabeled nodes. If None, initializes to an empty list.
+    :param unlabeled_nodes_list: Ordered set (dict) of unlabeled nodes. If None, initializes to an
+                                 empty dict.
     :param unknown_count: Number of labeled unknown nodes (unknown transmission ancestors).
-    :returns: A tuple containing the updated list of unlabeled nodes and the updated unknown count.
+    :param flat_tree: The tree flattened by _flatten_tree(), flattens the tree if None.
+    :param unknown_labels: List of the "Unknown-k" labels indexed by k, if None it is created.
+    :returns: A tuple containing the updated unlabeled nodes and the updated unknown count.
     """
 
     if unlabeled_nodes_list is None:
-        unlabeled_nodes_list = []
+        unlabeled_nodes_list = {}
+
+    if flat_tree is None:
+        flat_tree = _flatten_tree(tree)
+    nodes, _, blockcount, _, _ = flat_tree
+
+    # Skip nodes that already have a transmission ancestor
+    labeled = np.array([getattr(node, "transm_ancest", None) is not None for node in nodes],
+                       dtype=bool)
+    if nodes[0].is_root() and not labeled[0]:
+        # Enforce root blockcount to be -1 (ensure this is correct)
+        nodes[0].blockcount = -1
+        blockcount[0] = -1
+
+    # Nodes with a block get an unknown transmission ancestor label, numbered in levelorder
+    unknowns = np.flatnonzero(~labeled & (blockcount > 0))
+    if unknown_labels is None:
+        unknown_labels = [f"Unknown-{k}" for k in range(unknown_count + len(nodes))]
+    for k, i in enumerate(unknowns.tolist(), start=unknown_count):
+        nodes[i].transm_ancest = unknown_labels[k]
+    unknown_count += len(unknowns)
+
+    # None marks an unlabeled node, cheaper to test than hasattr in the propagation loops
+    for i in np.flatnonzero(~labeled & (blockcount <= 0)).tolist():
+        nodes[i].transm_ancest = None
+        unlabeled_nodes_list[nodes[i]] = None
 
-    for node in tree.traverse("levelorder"):
-        # Skip nodes that already have a transmission ancestor
-        if hasattr(node, "transm_ancest"):
-            continue
-
-        if node.is_root():
-            # Enforce root blockcount to be -1 (ensure this is correct)
-            node.blockcount = -1
-
-        if node.blockcount > 0:
-            # Node has a block, assign an unknown transmission ancestor label
-            node.transm_ancest = f"Unknown-{unknown_count}"
-            unknown_count += 1
+    return unlabeled_nodes_list, unknown_count
 
-        else:
-            unlabeled_nodes_list.append(node)
 
-    return unlabeled_nodes_list, unknown_count
+def _flatten_tree(tree: Tree) -> Tuple[List, np.ndarray, np.ndarray, np.ndarray, List]:
+    """
+    Flattens a tree into levelorder numbered arrays, node i is the i-th node in levelorder.
 
+    The tree is walked only once in preorder, the levelorder is the stable sort of the preorder by
+    depth. The leaves are returned in preorder, i.e. the order of iterating over the tree.
 
-def _label_top_infected_nodes(top_infected_nodes_list, unlabeled_nodes_list, unknown_count) -> \
-tuple[Any, Any]:
+    :param tree: The tree to flatten.
+    :returns: A tuple containing the list of nodes and the arrays of parent indices (-1 for the
+              root), blockcounts (-1 if missing) and topological depths of the nodes, as well as
+              the list of leaves in preorder.
+    """
+    preorder = list(tree.traverse("preorder"))
+    index = {node: i for i, node in enumerate(preorder)}
+    pre_parent = [-1] + [index[node.up] for node in preorder[1:]]
+    pre_depth = [0] * len(preorder)
+    for i in range(1, len(preorder)):
+        # parents are always visited before their children in preorder
+        pre_depth[i] = pre_depth[pre_parent[i]] + 1
+
+    order = np.argsort(np.array(pre_depth, dtype=np.int32), kind="stable")
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    parent = np.array(pre_parent, dtype=np.int32)[order]
+    parent[1:] = rank[parent[1:]]
+
+    nodes = [preorder[i] for i in order.tolist()]
+    blockcount = [getattr(node, "blockcount", -1) for node in nodes]
+    leaves = [node for node in preorder if not node.children]
+    return (nodes, parent, np.array(blockcount, dtype=np.int32),
+            np.array(pre_depth, dtype=np.int32)[order], leaves)
+
+
+def _label_top_infected_nodes(top_infected_nodes_list, unlabeled_nodes_list, unknown_count,
+                              unknown_labels) -> tuple[Any, Any]:
     """
     Labels transmission ancestry for top-infected nodes and their children.
 
@@ -180,62 +261,58 @@ tuple[Any, Any]:
 
     :param top_infected_nodes_list: List of nodes with transmission ancestry
                                     that need to propagate labels to their children.
-    :param unlabeled_nodes_list: List of nodes that need to be labeled with
+    :param unlabeled_nodes_list: Ordered set (dict) of nodes that need to be labeled with
                                  transmission ancestry.
+    :param unknown_count: The current count of labeled "Unknown" nodes.
+    :param unknown_labels: List of the "Unknown-k" labels indexed by k.
     :returns: Updated `unlabeled_nodes_list` after labeling top-infected nodes' children.
-    :raises AssertionError: If an unlabeled node is found or a non-binary tree is encountered.
+    :raises AssertionError: If a non-binary tree is encountered.
     """
+    # Nodes are only pushed after they have been labeled and are removed from the unlabeled nodes
+    # in the same iteration, so neither has to be checked again when they are popped.
     while top_infected_nodes_list:
         cur_node = top_infected_nodes_list.pop()
-        assert hasattr(cur_node, "transm_ancest"), "This node has to be labeled at this point.!"
-        assert cur_node not in unlabeled_nodes_list, \
-            "This node should not be in the unlabeled list!"
         if len(cur_node.children) > 0:
-            added_unknown = False
             assert len(cur_node.children) == 2, "Non binary tree found, not supported!"
             child1, child2 = cur_node.children
             # pull down label of parent if children are reachable and unlabeled
-            if not hasattr(child1, "transm_ancest"):
+            if child1.transm_ancest is None:
                 if child1.blockcount == -1:
                     child1.transm_ancest = cur_node.transm_ancest
                     top_infected_nodes_list.append(child1)
-            if not hasattr(child2, "transm_ancest"):
+            if child2.transm_ancest is None:
                 if child2.blockcount == -1:
                     child2.transm_ancest = cur_node.transm_ancest
                     top_infected_nodes_list.append(child2)
 
-            if not hasattr(child1, "transm_ancest"):
-                if not hasattr(child2, "transm_ancest"):
-                    # both children are unlabeld and have a blockcount > -1
+            if child1.transm_ancest is None:
+                if child2.transm_ancest is None:
+                    # both children are unlabeld and have a blockcount > -1, children with a
+                    # blockcount of -1 got the label of the parent above
                     # this is an unknown transmission ancestor
-                    assert child1.blockcount > -1, ("Has to have at least "
-                                                    "one transmission even on branch")
-                    assert child2.blockcount > -1, ("Has to have at least "
-                                                    "one transmission even on branch")
-                    child1.transm_ancest = f"Unknown-{unknown_count}"
-                    child2.transm_ancest = f"Unknown-{unknown_count}"
+                    child1.transm_ancest = unknown_labels[unknown_count]
+                    child2.transm_ancest = unknown_labels[unknown_count]
                     unknown_count += 1
                 # only child1 is unlabeled and the infector of child2 is the infector of child1
                 child1.transm_ancest = child2.transm_ancest
-            if not hasattr(child2, "transm_ancest"):
+            if child2.transm_ancest is None:
                 # only child 2 is still unlabled
                 child2.transm_ancest = child1.transm_ancest
 
-            if child1 in unlabeled_nodes_list:
-                unlabeled_nodes_list.remove(child1)
-            if child2 in unlabeled_nodes_list:
-                unlabeled_nodes_list.remove(child2)
+            unlabeled_nodes_list.pop(child1, None)
+            unlabeled_nodes_list.pop(child2, None)
     return unlabeled_nodes_list, unknown_count
 
 
-def _label_all_remaining_unknowns(unlabeled_nodes_list: List, unknown_count: int) -> None:
+def _label_all_remaining_unknowns(unlabeled_nodes_list: List, unknown_count: int,
+                                  unknown_labels: List[str]) -> int:
     """
     Labels all nodes in the provided list with the unknown transmission history
     IMPORTANT: This function assumes that the list of unlabeled nodes provided
     is sorted according to their level in the tree.
 
-    The function modifies the nodes in place and does not return
-    any values. The unknown_count is updated as each node is labeled.
+    The function modifies the nodes in place and returns the updated
+    unknown_count, which is incremented for every new unknown label.
 
     The method works as follows:
 
@@ -244,7 +321,7 @@ def _label_all_remaining_unknowns(unlabeled_nodes_list: List, unknown_count: int
       the node inherits the parent’s transmission ancestry.
     - If neither of the above conditions are true:
       the function checks the node’s sibling for a label.
-    - If the sibling has a transmission ancestry:
+    - If the sibling has a blockcount of -1 or 0 and a transmission ancestry:
       the node is labeled with the same identifier.
     - If no valid label is found:
       the node is labeled with a new "Unknown-{unknown_count}" label.
@@ -252,9 +329,11 @@ def _label_all_remaining_unknowns(unlabeled_nodes_list: List, unknown_count: int
     :param unlabeled_nodes_list: List of nodes to be labeled
                                  with transmission ancestry identifiers.
     :param unknown_count: The current count of labeled "Unknown" nodes
+    :param unknown_labels: List of the "Unknown-k" labels indexed by k
+    :returns: The updated count of labeled "Unknown" nodes
     """
     for node in unlabeled_nodes_list:
-        if hasattr(node, "transm_ancest"):
+        if node.transm_ancest is not None:
             # This case should not happen, if it does it needs to be figured out...
             raise NotImplementedError("Needs correct implementation... or bug fix...")
         assert node.blockcount < 1, "These nodes should be labeled at this point in the code."
@@ -262,24 +341,24 @@ def _label_all_remaining_unknowns(unlabeled_nodes_list: List, unknown_count: int
         # at this point there is no path to any leaf from here
         # since we have ordered the nodes in the list
         # according to their 'level' in the tree the ancestry pulls down
-        if node.is_root():
-            node.transm_ancest = f"Unknown-{unknown_count}"
+        parent = node.up
+        if parent is None:
+            node.transm_ancest = unknown_labels[unknown_count]
             unknown_count += 1
-        elif node.up.blockcount == -1:
-            node.transm_ancest = node.up.transm_ancest
+        elif parent.blockcount == -1:
+            node.transm_ancest = parent.transm_ancest
         else:
-            node_sibling = next(x for x in node.up.children if x != node)
-            if node_sibling.blockcount == -1:
-                if hasattr(node_sibling, "transm_ancest"):
-                    node.transm_ancest = node_sibling.transm_ancest
-                else:
-                    # Internal path that consists of unknown transmission
-                    # ancestry but haven't labeled it yet
-                    node.transm_ancest = f"Unknown-{unknown_count}"
-                    unknown_count += 1
-            if node_sibling.blockcount == 0 and hasattr(node_sibling, "transm_ancest"):
+            child0, child1 = parent.children
+            node_sibling = child1 if child0 is node else child0
+            if node_sibling.blockcount == -1 and node_sibling.transm_ancest is not None:
+                # The sibling lives in the host of the parent, which is the same for this node
+                node.transm_ancest = node_sibling.transm_ancest
+            elif node_sibling.blockcount == 0 and node_sibling.transm_ancest is not None:
                 # Path of unknown transmission, if already labeled reuse that unknown label!
                 node.transm_ancest = node_sibling.transm_ancest
             else:
-                node.transm_ancest = f"Unknown-{unknown_count}"
+                # Internal path that consists of unknown transmission
+                # ancestry but haven't labeled it yet
+                node.transm_ancest = unknown_labels[unknown_count]
                 unknown_count += 1
+    return unknown_count
@@ -12,8 +12,10 @@ from pyccd.tree import Tree
 
 def read_nexus_trees(file: str, breath_trees: bool = True,
                      label_transm_history: bool = True,
-                     parse_taxon_map: bool = False) \
-        -> list[Tree] | tuple[list[Tree], dict[str, str]]:
+                     parse_taxon_map: bool = False,
+                     parse_header: bool = False) \
+        -> list[Tree] | tuple[list[Tree], dict[str, str]] | tuple[list[Tree], list[str]] \
+        | tuple[list[Tree], dict[str, str], list[str]]:
     """
     Function to read a nexus file that contains transmission trees.
     This assumes that trees are generated by BREATH BEAST2 package.
@@ -26,7 +28,10 @@ def read_nexus_trees(file: str, breath_trees: bool = True,
     :param file: Input file
     :param breath_trees: If true, will assume that the trees have the blockcount annotated (default)
     :param label_transm_history: If true, will label transmission ancestry (default)
-    :returns: list of transmission trees
+    :param parse_taxon_map: If true, will also return the taxon map of the translate block
+    :param parse_header: If true, will also return all lines before the first tree line
+    :returns: list of transmission trees, followed by the taxon map and the header lines if
+              requested
     """
     # re_tree returns nwk string without the root height and no ; in the end
     re_tree = re.compile("\t?tree .*=? (.*$)", flags=re.I | re.MULTILINE)
@@ -37,9 +42,17 @@ def read_nexus_trees(file: str, breath_trees: bool = True,
     begin_taxon_map = False
     taxon_map = {}
     trees = []
+    header_lines = []
+    in_header = parse_header
 
     with open(file, 'r', encoding="utf-8") as f:
         for line in f:
+            if in_header:
+                if line.strip().startswith("tree "):
+                    in_header = False
+                else:
+                    header_lines.append(line)
+
             if parse_taxon_map:
                 if begin_taxon_map:
                     if re_end_map.match(line):
@@ -100,8 +113,12 @@ def read_nexus_trees(file: str, breath_trees: bool = True,
         for tree in trees:
             label_transmission_tree(tree)
 
+    if parse_taxon_map and parse_header:
+        return trees, taxon_map, header_lines
     if parse_taxon_map:
         return trees, taxon_map
+    if parse_header:
+        return trees, header_lines
     return trees
 
 
@@ -3,20 +3,20 @@ Module contains the transcope Command line interface
 """
 import os
 import argparse
+import functools
 import sys
 
 from .read_nexus import read_nexus_trees
 from .transmission_ccd import get_transmission_maps, get_transmission_ccd_tree_bottom_up, TypeCCD
 
 
-def main():
-    """
-    Command line interface to calculate a transmission CCD-MAP tree with input options.
+@functools.lru_cache(maxsize=None)
+def _get_parser() -> argparse.ArgumentParser:
     """
-    prelim_parser = argparse.ArgumentParser(add_help=False)
-    prelim_parser.add_argument('--overwrite', action='store_true',)
-    prelim_args, _ = prelim_parser.parse_known_args()
+    Builds the transcope argument parser once and reuses it afterwards.
 
+    :return: The argument parser
+    """
     parser = argparse.ArgumentParser(description='Transmission CCD MAP tree computation',
                                      prog='transcope')
     parser.add_argument(
@@ -26,8 +26,7 @@ def main():
     )
     parser.add_argument('-o', '--output-tree',
                         help='Output Tree file (default: standard output)',
-                        type=argparse.FileType(f"{'w' if prelim_args.overwrite else 'x'}"),
-                        default=sys.stdout,
+                        default=None,
                         )
     parser.add_argument('-b', '--burn-in', nargs='?',
                         default=0.0,  # default value
@@ -49,8 +48,25 @@ def main():
                         default=1337,
                         type=int)
 
+    return parser
+
+
+def main():
+    """
+    Command line interface to calculate a transmission CCD-MAP tree with input options.
+    """
+    parser = _get_parser()
     args = parser.parse_args()
 
+    output_tree = sys.stdout
+    if args.output_tree is not None:
+        # --overwrite decides whether an existing output file may be replaced
+        try:
+            output_tree = open(args.output_tree,  # pylint: disable=consider-using-with
+                               'w' if args.overwrite else 'x', encoding="UTF-8")
+        except OSError as e:
+            parser.error(f"argument -o/--output-tree: can't open '{args.output_tree}': {e}")
+
     if not os.path.isfile(args.input_trees):
         print(f"Error: input tree file {args.input_trees} does not exist!", file=sys.stderr)
         sys.exit(1)
@@ -60,7 +76,7 @@ def main():
 
     if args.verbose:
         print("Parsing input trees...", file=sys.stderr)
-    trees = read_nexus_trees(args.input_trees, breath_trees=True)
+    trees, header_lines = read_nexus_trees(args.input_trees, breath_trees=True, parse_header=True)
     trees = trees[int(args.burn_in * len(trees)):]
     if len(trees) < 1:
         print("Input trees empty after burn-in removal, maybe burn-in too high?", file=sys.stderr)
@@ -77,13 +93,15 @@ def main():
     if args.verbose:
         print("Writing transmission CCD-MAP tree to file...", file=sys.stderr)
 
-    with open(args.input_trees, 'r', encoding="UTF-8") as infile:
-        for line in infile:
-            if line.strip().startswith("tree "):
-                break  # Stop reading when the tree section starts
-            args.output_tree.write(line)
-
-        args.output_tree.write(f"tree tCCD_MAP = {newick_map};\nEnd;\n")
+    # the header of the input file, i.e. everything before the tree section, was kept when parsing
+    # one write for the header, the newick string is written as is without copying it into a
+    # formatted string first
+    output_tree.write("".join(header_lines))
+    output_tree.write("tree tCCD_MAP = ")
+    output_tree.write(newick_map)
+    output_tree.write(";\nEnd;\n")
+    if output_tree is not sys.stdout:
+        output_tree.close()
 
     if args.verbose:
         print("Done invoking transcope.", file=sys.stderr)
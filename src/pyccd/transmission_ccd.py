@@ -1,12 +1,13 @@
 """
 This module contains all the functions relevant for creating transmission CCDs.
 """
-import random
 import warnings
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from functools import total_ordering
+from operator import attrgetter
+from typing import Callable
 
 import numpy as np
 
@@ -27,7 +28,7 @@ class TypeCCD(Enum):
 
 
 @total_ordering
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class BaseClade:
     """
     Base class representing a clade — a set of taxa/leaves.
@@ -36,6 +37,14 @@ class BaseClade:
         clade (frozenset): A frozen set of taxa or node labels in this clade.
     """
     clade: frozenset
+    # clades are hashed for every dict operation, the hash is computed once in __post_init__
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_hash", hash((self.clade,)))
+
+    def __hash__(self) -> int:
+        return self._hash
 
     def __len__(self) -> int:
         """Return the number of taxa/nodes in the clade."""
@@ -52,7 +61,7 @@ class BaseClade:
         return isinstance(other, BaseClade) and self.clade == other.clade
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class TransmissionBlockClade(BaseClade):
     """
     Clade with a flag indicating whether a transmission block (event) occurred on the edge.
@@ -62,8 +71,14 @@ class TransmissionBlockClade(BaseClade):
     """
     has_block: bool
 
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_hash", hash((self.clade, self.has_block)))
+
+    def __hash__(self) -> int:
+        return self._hash
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class TransmissionAncestryClade(BaseClade):
     """
     Clade with transmission ancestor, i.e. who infected this clade.
@@ -73,6 +88,12 @@ class TransmissionAncestryClade(BaseClade):
     """
     transm_ancest: str
 
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_hash", hash((self.clade, self.transm_ancest)))
+
+    def __hash__(self) -> int:
+        return self._hash
+
 
 def get_transmission_maps(trees: list[Tree] | tuple[Tree], type_str: str = "Ancestry") -> tuple:
     """
@@ -85,8 +106,10 @@ def get_transmission_maps(trees: list[Tree] | tuple[Tree], type_str: str = "Ance
                      construct.
     :param trees: list of Trees from which to extract the clade splits
                   from.
-    :returns: Tuple of m1 (Clade counts), m2 (Clade split counts),
-              blockcount_map (Blockcount counts), branch_lengths_map (Branch lengths)
+    :returns: Tuple of m1 (Clade counts), m2 (Clade split counts, nested by parent clade as
+              m2[parent][(child0, child1)] instead of a flat m2[(parent, child0, child1)]),
+              blockcount_map (Blockcounts per clade), branch_lengths_map (Branch lengths per
+              clade), both map to lists
     """
     try:
         # Converting type to an enum if possible
@@ -96,124 +119,105 @@ def get_transmission_maps(trees: list[Tree] | tuple[Tree], type_str: str = "Ance
                          f"Expected one of: {', '.join([item.value for item in TypeCCD])}") from e
 
     m1 = defaultdict(int)  # map for each clade how often it got sampled
-    m2 = defaultdict(
-        int)  # map for each (c1,c2) clade how often this specific relation got sampled
+    # map for each parent clade how often each (c1,c2) split got sampled
+    m2 = defaultdict(lambda: defaultdict(int))
 
     blockcount_map = defaultdict(list)
     branch_lengths_map = defaultdict(list)
 
-    # traversing all nodes of all trees using levelorder traversal
-    for node in (node for t in trees for node in t.traverse("levelorder")):
-        assert hasattr(node, "name"), "Node should have a name!"
-        assert hasattr(node, "blockcount"), (
-            "The nodes should have the blockcount "
-            "attribute!")
-        if len(node) > 1:
-            assert len(node.children) == 2, "Non binary tree not supported!"
-
-            parent_clade, child0_clade, child1_clade, blockcount_map, branch_lengths_map = (
-                _add_internal_clade(node, ccd_type, blockcount_map,
-                                    branch_lengths_map))
-
-            m1[parent_clade] += 1
-            # child0 and child1 are sorted within _add_internal_node function
-            # child0 always contains the min leaf label among the two clades
-            m2[(parent_clade, child0_clade, child1_clade)] += 1
-
-        elif len(node) == 1:
-            assert node.is_leaf(), "Should be a leaf node!"
-            # leaf node for which we need to add the blockcount to the blockcount_map
-            blockcount_map, branch_lengths_map = _add_leaf_clade(node, ccd_type,
-                                                                 blockcount_map,
-                                                                 branch_lengths_map)
+    # clade constructor and the node attribute it is built from are fixed for all nodes
+    clade_ctor, attr_of = _clade_factory(ccd_type)
+
+    leafset_cache = {}
+    for t in trees:
+        _annotate_leafsets(t, leafset_cache)
+
+        # traversing all nodes of the tree using levelorder traversal, i.e. the clade of a node
+        # has already been built as child clade of its parent, except for the root
+        for node in t.traverse("levelorder"):
+            assert hasattr(node, "name"), "Node should have a name!"
+            assert hasattr(node, "blockcount"), (
+                "The nodes should have the blockcount "
+                "attribute!")
+            if node.up is None:
+                node._clade = clade_ctor(node._leafset, attr_of(node))
+            clade = node._clade
+
+            if len(node._leafset) > 1:
+                assert len(node.children) == 2, "Non binary tree not supported!"
+                child0, child1 = node.children
+                child0._clade = clade_ctor(child0._leafset, attr_of(child0))
+                child1._clade = clade_ctor(child1._leafset, attr_of(child1))
+
+                m1[clade] += 1
+                # child0 always contains the min leaf label among the two clades
+                if child0._min < child1._min:
+                    m2[clade][(child0._clade, child1._clade)] += 1
+                else:
+                    m2[clade][(child1._clade, child0._clade)] += 1
+
+            # Keeping track of blockcounts if not -1, for internal and leaf clades
+            blockcount = node.blockcount
+            if blockcount != -1:
+                blockcount_map[clade].append(blockcount)
+            # adding distance of the clade to map of branch lengths
+            branch_lengths_map[clade].append(node.dist)
 
     return m1, m2, blockcount_map, branch_lengths_map
 
 
-def _add_internal_clade(node, ccd_type, blockcount_map: dict,
-                        branch_lengths_map: dict) \
-        -> tuple[BaseClade, BaseClade, BaseClade, dict, dict]:
-    """
-    Processes an internal node by constructing parent and child clades based on the CCD type,
-    and updates blockcount and branch length maps accordingly.
-
-    :param node: The internal tree node to process. Assumed to have two children, a blockcount,
-                 branch length (dist), and optionally transmission ancestry.
-    :param ccd_type: Type of CCD to use and construct clades for.
-    :param blockcount_map: Dictionary mapping clades to a list of blockcounts.
-    :param branch_lengths_map: Dictionary mapping clades to a list of branch lengths.
-    :returns: A tuple containing the parent clade,
-              the two child clades (ordered by minimum leaf label),
-              and the updated blockcount and branch lengths maps.
+def _annotate_leafsets(tree: Tree, leafset_cache: dict = None) -> None:
     """
-    c0_leafs = {int(leaf.name) for leaf in node.children[0]}
-    c1_leafs = {int(leaf.name) for leaf in node.children[1]}
-    parent_clade_set = frozenset(sorted(c0_leafs.union(c1_leafs)))
-
-    match ccd_type:
-        case TypeCCD.BLOCKS:
-            parent_clade = TransmissionBlockClade(parent_clade_set,
-                                                  node.blockcount != -1)
-            child0_clade = TransmissionBlockClade(frozenset(c0_leafs),
-                                                  node.children[
-                                                      0].blockcount != -1)
-            child1_clade = TransmissionBlockClade(frozenset(c1_leafs),
-                                                  node.children[
-                                                      1].blockcount != -1)
-        case TypeCCD.ANCESTRY:
-            parent_clade = TransmissionAncestryClade(parent_clade_set,
-                                                     node.transm_ancest)
-            child0_clade = TransmissionAncestryClade(frozenset(c0_leafs),
-                                                     node.children[
-                                                         0].transm_ancest)
-            child1_clade = TransmissionAncestryClade(frozenset(c1_leafs),
-                                                     node.children[
-                                                         1].transm_ancest)
-        case _:
-            raise ValueError(f"Unknown type given: {ccd_type}")
-
-    # Keeping track of blockcounts if not -1
-    if node.blockcount != -1:
-        blockcount_map[parent_clade].append(node.blockcount)
-
-    # adding distance of parent clade to map of branch lengths
-    branch_lengths_map[parent_clade].append(node.dist)
+    Annotates every node with the frozenset of the integer leaf labels below it as _leafset and
+    the smallest of these labels as _min. Computed in a single postorder pass on bitmasks of the
+    leaf labels (_mask), the mask of a parent is the union of its children's masks.
 
-    # Depending on the lower value leaf we return child0 and child1 clades
-    if min(c0_leafs) < min(c1_leafs):
-        return parent_clade, child0_clade, child1_clade, blockcount_map, branch_lengths_map
-    return parent_clade, child1_clade, child0_clade, blockcount_map, branch_lengths_map
+    Frozensets are only built for masks that are not in the cache yet, i.e. the same clade in
+    different trees shares one frozenset, which also lets clade comparisons succeed on identity.
 
-
-def _add_leaf_clade(node, ccd_type: TypeCCD, blockcount_map: dict,
-                    branch_lengths_map: dict) -> tuple[dict, dict]:
+    :param tree: Tree with integer leaf names
+    :param leafset_cache: Map from bitmask to frozenset, shared between trees
+    """
+    if leafset_cache is None:
+        leafset_cache = {}
+
+    for node in tree.traverse("postorder"):
+        if node.children:
+            mask = 0
+            for c in node.children:
+                mask |= c._mask
+            leafset = leafset_cache.get(mask)
+            if leafset is None:
+                leafset = frozenset().union(*(c._leafset for c in node.children))
+                leafset_cache[mask] = leafset
+            node._min = min(c._min for c in node.children)
+        else:
+            node._min = int(node.name)
+            mask = 1 << node._min
+            leafset = leafset_cache.get(mask)
+            if leafset is None:
+                leafset = frozenset({node._min})
+                leafset_cache[mask] = leafset
+        node._mask = mask
+        node._leafset = leafset
+
+
+def _clade_factory(ccd_type: TypeCCD) -> tuple[type, Callable]:
     """
-    Processes a leaf node by creating an appropriate clade based on the CCD type,
-    and updates blockcount and branch length maps accordingly.
+    Returns the clade class for the given CCD type and a function that extracts the additional
+    clade attribute from a node.
 
-    :param node: The tree node corresponding to a leaf.
     :param ccd_type: Type of CCD to use and construct clades for.
-    :param blockcount_map: Dictionary mapping clades to a list of blockcounts.
-    :param branch_lengths_map: Dictionary mapping clades to a list of branch lengths.
-    :returns: Updated blockcount_map and branch_lengths_map.
+    :returns: Tuple of the clade class and the function node -> clade attribute
     """
     match ccd_type:
         case TypeCCD.BLOCKS:
-            leaf_clade = TransmissionBlockClade(frozenset({int(node.name)}),
-                                                (node.blockcount != -1))
+            return TransmissionBlockClade, lambda node: node.blockcount != -1
         case TypeCCD.ANCESTRY:
-            leaf_clade = TransmissionAncestryClade(frozenset({int(node.name)}),
-                                                   node.transm_ancest)
+            return TransmissionAncestryClade, attrgetter("transm_ancest")
         case _:
             raise ValueError(f"Unknown type given: {ccd_type}")
 
-    # Keeping track of blockcount for summarization, regardless of type
-    if node.blockcount != -1:
-        blockcount_map[leaf_clade].append(node.blockcount)
-    # Adding the branch length to the branch_length_map
-    branch_lengths_map[leaf_clade].append(node.dist)
-    return blockcount_map, branch_lengths_map
-
 
 def get_transmission_ccd_tree_bottom_up(m1: dict, m2: dict,
                                         blockcount_map: dict,
@@ -230,56 +234,67 @@ def get_transmission_ccd_tree_bottom_up(m1: dict, m2: dict,
     are used to construct the MAP tree, which is returned in Newick format.
 
     :param m1: A dictionary with clades as keys and their occurrences as values.
-    :param m2: A dictionary with cladesplits as keys and their probabilities as values.
+    :param m2: A dictionary with clades as keys and dictionaries of their splits (child0, child1)
+               to occurrences as values.
     :param blockcount_map: A mapping of clades to their respective block counts
     :param branch_lengths_map: A mapping of clades to their respective branch lengths
     :param seed: A seed for the random number generator to control tie-breaking. Default is 42.
     :returns: A string representing the tree in Newick format, annotated with median block-counts
               and mean branch lengths (might change in future versions).
     """
-    # Seed used for tie breaking using random.random() <= 0.5
-    random.seed(seed)
+    # Seed used for tie breaking, uniform draws < 0.5 choose the new split. There are at most as
+    # many ties as splits, so all draws are made at once and consumed in order.
+    tie_draws = np.random.default_rng(seed).random(sum(len(splits) for splits in m2.values()))
+    n_ties = 0
 
     seen_resolved_clades = {}
+    # probability of the best resolution of each clade, leaf clades (only part of m2) are 1
+    clade_prob = {child: 1.0 for splits in m2.values() for split in splits for child in split
+                  if len(child) == 1}
 
-    # sorted list of all clades, small (cherries) to big
-    for current_clade in sorted(list(m1.keys()), key=len):
-        # the following are all triplets that represent how the current clade splits
+    # all clades, small (cherries) to big, bucketed by size which keeps the m1 order per size
+    clades_by_size = defaultdict(list)
+    for clade in m1:
+        clades_by_size[len(clade)].append(clade)
 
-        for current_split in (i for i in m2 if i[0] == current_clade):
-            child1, child2 = current_split[1], current_split[2]
-
-            assert current_clade == current_split[0], "This should be the same."
-            assert (len(child1) == 1 or child1 in seen_resolved_clades), \
-                "child1 should be in seen_resolved_clades when its length > 1"
-            assert (len(child2) == 1 or child2 in seen_resolved_clades), \
-                "child2 should be in seen_resolved_clades when its length > 1"
-
-            c1_prob = 1 if len(child1) == 1 else seen_resolved_clades[child1][0]
-            c2_prob = 1 if len(child2) == 1 else seen_resolved_clades[child2][0]
-
-            # cur_prob = m2[current_split] / m1[current_split[0]]
-            split_prob = c1_prob * c2_prob * (
-                    m2[current_split] / m1[current_clade])
-
-            if current_clade in seen_resolved_clades:
-                if seen_resolved_clades[current_clade][0] < split_prob:
-                    seen_resolved_clades[current_clade] = (split_prob,
-                                                           current_split, False)
-                elif seen_resolved_clades[current_clade][0] == split_prob:
-                    # choose 50/50 if we want to update or keep the old better split.
-                    if random.random() < 0.5:
-                        # choose the new split
-                        chosen_prob, chosen_split = split_prob, current_split
-                    else:
-                        # choose the old split
-                        chosen_prob, chosen_split = seen_resolved_clades[current_clade][:2]
-                    # Thrid entry True because tiebreaking is in effect for this split.
-                    seen_resolved_clades[current_clade] = (chosen_prob, chosen_split, True)
-
-            else:
-                seen_resolved_clades[current_clade] = (split_prob,
-                                                       current_split, False)
+    clade_order = [clade for size in sorted(clades_by_size) for clade in clades_by_size[size]]
+    for current_clade in clade_order:
+        parent_count = m1[current_clade]
+        # (probability, split, tiebreaking) of the best split of the current clade so far
+        best = None
+
+        # the following are all triplets that represent how the current clade splits
+        for (child1, child2), split_count in m2.get(current_clade, {}).items():
+            # division kept instead of multiplying with 1 / parent_count, which could round
+            # differently and change which splits are detected as ties
+            split_ccp = split_count / parent_count
+            if best is not None and split_ccp < best[0]:
+                # child probabilities are at most 1, this split can neither beat nor tie the best
+                continue
+
+            current_split = (current_clade, child1, child2)
+
+            assert child1 in clade_prob, "child1 should be resolved before its parent"
+            assert child2 in clade_prob, "child2 should be resolved before its parent"
+
+            split_prob = clade_prob[child1] * clade_prob[child2] * split_ccp
+
+            if best is None or best[0] < split_prob:
+                best = (split_prob, current_split, False)
+            elif best[0] == split_prob:
+                # choose 50/50 if we want to update or keep the old better split.
+                # Third entry True because tiebreaking is in effect for this split.
+                n_ties += 1
+                if tie_draws[n_ties - 1] < 0.5:
+                    # choose the new split
+                    best = (split_prob, current_split, True)
+                else:
+                    # choose the old split
+                    best = (best[0], best[1], True)
+
+        if best is not None:
+            seen_resolved_clades[current_clade] = best
+            clade_prob[current_clade] = best[0]
 
     # construct the root clade and build a tree dict
     root_clade = max(seen_resolved_clades.keys())
@@ -293,10 +308,13 @@ def get_transmission_ccd_tree_bottom_up(m1: dict, m2: dict,
 def recursive_nwk_split_dict(clade, output, blockcount_map,
                              branch_lengths_map) -> str:
     """
-    Recursively generates a Newick string for the given clade.
+    Generates a Newick string for the given clade.
     Currently, it annotates the median blockcount if a block is present.
     If the given clade is a TransmissionAncestryClade it also annotates that.
 
+    The clades are walked with an explicit stack instead of recursion and the Newick fragments
+    are joined once at the end.
+
     :param clade: The clade to generate the Newick string for.
     :param output: A dictionary containing the child clades for each parent.
                    As computed by the _build_tree_dirct_from_clade_splits function.
@@ -305,25 +323,45 @@ def recursive_nwk_split_dict(clade, output, blockcount_map,
     :returns: A string representing the tree in Newick format,
               annotated with meadian blockcount and mean branch lengths.
     """
-    if len(clade) == 1:
-        # Base case for leaf node
-        return (f"{next(iter(clade.clade))}"
-                f"[&blockcount="
-                f"{np.median(blockcount_map[clade]) if clade in blockcount_map else -1},"
-                f"&transmission.ancestor="
-                f"{clade.transm_ancest if isinstance(clade, TransmissionAncestryClade) else 'None'}"
-                f"]"
-                f":{np.mean(branch_lengths_map[clade])}")
-    return (
-        "("
-        f"{recursive_nwk_split_dict(output[clade][0], output, blockcount_map, branch_lengths_map)},"
-        f"{recursive_nwk_split_dict(output[clade][1], output, blockcount_map, branch_lengths_map)})"
-        f"[&blockcount={np.median(blockcount_map[clade]) if clade in blockcount_map else -1},"
-        f"&transmission.ancestor="
-        f"{clade.transm_ancest if isinstance(clade, TransmissionAncestryClade) else 'None'}"
-        f"]:"
-        f"{np.mean(branch_lengths_map[clade])}"
-    )
+    # all clades of a tree are of the same type, decide once whether to annotate the ancestor
+    is_ancestry = isinstance(clade, TransmissionAncestryClade)
+    parts = []
+    # stack of clades still to be written and string fragments that close an internal clade
+    stack = [clade]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif len(item) == 1:
+            # leaf node
+            parts.append(f"{next(iter(item.clade))}")
+            parts.append(_nwk_annotation(item, blockcount_map, branch_lengths_map, is_ancestry))
+        else:
+            left, right = output[item]
+            parts.append("(")
+            stack.append(
+                f"){_nwk_annotation(item, blockcount_map, branch_lengths_map, is_ancestry)}")
+            stack.append(right)
+            stack.append(",")
+            stack.append(left)
+    return "".join(parts)
+
+
+def _nwk_annotation(clade, blockcount_map, branch_lengths_map, is_ancestry: bool) -> str:
+    """
+    Returns the Newick annotation and branch length of a clade, i.e. the part that follows the
+    leaf label or the closing bracket of the clade.
+
+    :param clade: The clade to annotate.
+    :param blockcount_map: A dictionary mapping clades to their associated blockcount values.
+    :param branch_lengths_map: A dictionary mapping clades to their branch lengths.
+    :param is_ancestry: Whether the clade is a TransmissionAncestryClade.
+    :returns: Annotation with median blockcount and transmission ancestor and mean branch length.
+    """
+    return (f"[&blockcount={np.median(blockcount_map[clade]) if clade in blockcount_map else -1},"
+            f"&transmission.ancestor="
+            f"{clade.transm_ancest if is_ancestry else 'None'}"
+            f"]:{np.mean(branch_lengths_map[clade])}")
 
 
 def _build_tree_dict_from_clade_splits(root_clade: BaseClade,
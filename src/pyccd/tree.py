@@ -4,8 +4,11 @@ Please see ete3 for more detail and the original code.
 LB: This is here because I don't need the full dependency and also don't want to have to wait for
 them to update to newer versions or fix problems...
 """
+import functools
+import operator
 import os
 import re
+import sys
 from collections import deque
 
 DEFAULT_DIST = 1.0
@@ -14,12 +17,24 @@ DEFAULT_NAME = ""
 
 ITERABLE_TYPES = {list, set, tuple, frozenset}
 _ILEGAL_NEWICK_CHARS = ":;(),[]\t\n\r="
+_ILEGAL_NEWICK_CHARS_RE = re.compile("[" + _ILEGAL_NEWICK_CHARS + "]")
 _NHX_RE = "[&&NHX:[^]]*]"
 
 _QUOTED_TEXT_RE = r"""((?=["'])(?:"[^"\\]*(?:\\[\s\S][^"\\]*)*"|'[^'\\]*(?:\\[\s\S][^'\\]*)*'))"""
 _QUOTED_TEXT_PREFIX = 'ete3_quotref_'
 _NAME_RE = "[^():,;]+?"
 _FLOAT_RE = r"\s*[+-]?\d+\.?\d*(?:[eE][-+]?\d+)?\s*"
+_NEWICK_STRUCTURE_RE = re.compile("[(),]")
+_QUOTED_TEXT_MATCHER = re.compile(_QUOTED_TEXT_RE)
+# line breaks and tabs are removed from Newick strings before parsing
+_NEWICK_WHITESPACE_TABLE = str.maketrans("", "", "\n\r\t")
+_FLOAT_CHARS = frozenset("0123456789.eE+-")
+# node data containing any of these is left to the matcher, which rejects what _NAME_RE excludes
+_NODE_DATA_SPECIAL_RE = re.compile(r"[(),;\[\]]")
+# children of nodes without any, shared by all leaves, add_child replaces it with a list
+_NO_CHILDREN = ()
+# default for feature lookups, tells missing features apart from features set to None
+_MISSING = object()
 FLOAT_FORMATTER = "%0.6g"
 NAME_FORMATTER = "%s"
 
@@ -37,16 +52,21 @@ class TreeError(Exception):
 
 
 class TreeNode(object):
+    # the basic node attributes are slots, all other features (e.g. blockcount) end up in __dict__
+    __slots__ = ("_children", "_up", "_dist", "_support", "_img_style", "_extra_features", "name",
+                 "dist", "__dict__")
+    # features every node has, only additional features are tracked per node
+    _BASE_FEATURES = frozenset({"dist", "support", "name"})
+
     def __init__(self, newick=None, format=0, dist=None, support=None,
                  name=None, quoted_node_names=False):
-        self._children = []
+        self._children = _NO_CHILDREN
         self._up = None
         self._dist = DEFAULT_DIST
         self._support = DEFAULT_SUPPORT
         self._img_style = None
-        self.features = set([])
-        # Add basic features
-        self.features.update(["dist", "support", "name"])
+        # names of features added beyond the basic ones, allocated on the first such feature
+        self._extra_features = None
         if dist is not None:
             self.dist = dist
         if support is not None:
@@ -64,6 +84,13 @@ class TreeNode(object):
         """Node len returns number of children."""
         return len(self.get_leaves())
 
+    def __bool__(self):
+        """
+        A node is always True, without this bool() falls back to __len__
+        which traverses all leaves below the node.
+        """
+        return True
+
     def iter_leaves(self, is_leaf_fn=None):
         """
         Returns an iterator over the leaves under this node.
@@ -71,13 +98,24 @@ class TreeNode(object):
         :argument None is_leaf_fn: See :func:`TreeNode.traverse` for
           documentation.
         """
-        for n in self.traverse(strategy="preorder", is_leaf_fn=is_leaf_fn):
-            if not is_leaf_fn:
-                if n.is_leaf():
-                    yield n
+        if is_leaf_fn is None:
+            return self._iter_leaves_only()
+        return (n for n in self.traverse(strategy="preorder", is_leaf_fn=is_leaf_fn)
+                if is_leaf_fn(n))
+
+    def _iter_leaves_only(self):
+        """
+        Iterator over the leaves under this node in preorder, internal
+        nodes are only descended into and never yielded.
+        """
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            children = node._children
+            if children:
+                to_visit.extend(reversed(children))
             else:
-                if is_leaf_fn(n):
-                    yield n
+                yield node
 
     def get_leaves(self, is_leaf_fn=None):
         """
@@ -86,7 +124,7 @@ class TreeNode(object):
         :argument None is_leaf_fn: See :func:`TreeNode.traverse` for
           documentation.
         """
-        return [n for n in self.iter_leaves(is_leaf_fn=is_leaf_fn)]
+        return list(self.iter_leaves(is_leaf_fn=is_leaf_fn))
 
     def __iter__(self):
         """ Iterator over leaf nodes"""
@@ -106,6 +144,13 @@ class TreeNode(object):
         else:
             raise TreeError("Incorrect children type")
 
+    @property
+    def features(self):
+        """Names of the features of this node, the basic ones and all added ones."""
+        if self._extra_features is None:
+            return set(self._BASE_FEATURES)
+        return self._extra_features | self._BASE_FEATURES
+
     @property
     def up(self):
         return self._up
@@ -152,7 +197,9 @@ class TreeNode(object):
         if support is not None:
             child.support = support
 
-        self.children.append(child)
+        if self._children is _NO_CHILDREN:
+            self._children = []
+        self._children.append(child)
         child.up = self
         return child
 
@@ -161,15 +208,17 @@ class TreeNode(object):
         Add or update a node's feature.
         """
         setattr(self, pr_name, pr_value)
-        self.features.add(pr_name)
+        if pr_name not in self._BASE_FEATURES:
+            if self._extra_features is None:
+                self._extra_features = set()
+            self._extra_features.add(pr_name)
 
     def add_features(self, **features):
         """
         Add or update several features.
         """
         for fname, fvalue in features.items():
-            setattr(self, fname, fvalue)
-            self.features.add(fname)
+            self.add_feature(fname, fvalue)
 
     def traverse(self, strategy="levelorder", is_leaf_fn=None):
         """
@@ -210,19 +259,20 @@ class TreeNode(object):
         else:
             _leaf = self.__class__.is_leaf
 
+        # None below the children of a node marks that the node itself is next, in postorder
         while to_visit:
-            node = to_visit.pop(-1)
-            try:
-                node = node[1]
-            except TypeError:
+            node = to_visit.pop()
+            if node is None:
+                # POSTORDER ACTIONS
+                yield (True, to_visit.pop())
+            else:
                 # PREORDER ACTIONS
                 yield (False, node)
                 if not _leaf(node):
                     # ADD CHILDREN
-                    to_visit.extend(reversed(node.children + [[1, node]]))
-            else:
-                # POSTORDER ACTIONS
-                yield (True, node)
+                    to_visit.append(node)
+                    to_visit.append(None)
+                    to_visit.extend(reversed(node.children))
 
     def _iter_descendants_postorder(self, is_leaf_fn=None):
         to_visit = [self]
@@ -231,19 +281,18 @@ class TreeNode(object):
         else:
             _leaf = self.__class__.is_leaf
 
+        # None below the children of a node marks that the node itself is next
         while to_visit:
-            node = to_visit.pop(-1)
-            try:
-                node = node[1]
-            except TypeError:
-                # PREORDER ACTIONS
-                if not _leaf(node):
-                    # ADD CHILDREN
-                    to_visit.extend(reversed(node.children + [[1, node]]))
-                else:
-                    yield node
-            else:
+            node = to_visit.pop()
+            if node is None:
                 # POSTORDER ACTIONS
+                yield to_visit.pop()
+            elif not _leaf(node):
+                # ADD CHILDREN
+                to_visit.append(node)
+                to_visit.append(None)
+                to_visit.extend(reversed(node.children))
+            else:
                 yield node
 
     def _iter_descendants_levelorder(self, is_leaf_fn=None):
@@ -261,16 +310,12 @@ class TreeNode(object):
         """
         Iterator over all descendant nodes.
         """
-        to_visit = deque()
-        node = self
-        while node is not None:
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
             yield node
             if not is_leaf_fn or not is_leaf_fn(node):
-                to_visit.extendleft(reversed(node.children))
-            try:
-                node = to_visit.popleft()
-            except:
-                node = None
+                to_visit.extend(reversed(node.children))
 
     def get_distance(self, target, target2=None, topology_only=False):
         """
@@ -329,30 +374,30 @@ class TreeNode(object):
         :param name attr_t2: Compare trees using a custom node
                               attribute as a node name in target tree.
 
-        :returns: (rf, rf_max, common_attrs, names, edges_t1, edges_t2)
+        :returns: (rf, rf_max, edges_t1, edges_t2), the edges are bitmasks of taxon ids, the
+                  ids are numbered in postorder of the leaves of the reference tree
         """
         ref_t = self
         if len(ref_t.children) > 2 or len(target_t.children) > 2:
             raise TreeError(
                 "Unrooted tree found! Not supported in this package...")
 
-        attrs_t1 = {getattr(n, attr_t1) for n in ref_t.iter_leaves() if hasattr(n, attr_t1)}
-        attrs_t2 = {getattr(n, attr_t2) for n in target_t.iter_leaves() if hasattr(n, attr_t2)}
-        if attrs_t1 != attrs_t2:
+        # edges are compared as bitmasks of integer ids instead of sorted tuples of names, the ids
+        # are assigned while walking the reference tree and the target tree may not add any
+        taxon_id = {}
+        edges1, taxa1 = extract_edge_set(ref_t, attr_t1, taxon_id, new_taxa=True)
+        try:
+            edges2, taxa2 = extract_edge_set(target_t, attr_t2, taxon_id)
+        except KeyError:
+            taxa2 = None
+        if taxa1 != taxa2:
             raise TreeError("Trees have different taxa sets, not supported...")
 
-        edges1 = extract_edge_set(ref_t, attr_t1)
-        edges2 = extract_edge_set(target_t, attr_t2)
-
-        # the two root edges are never counted here, as they are always
-        # present in both trees because of the common attr filters
         rf = len((edges1 ^ edges2))
 
-        # Otherwise we need to count the actual number of valid
-        # partitions in each tree -2 is to avoid counting the root
-        # partition of the two trees (only needed in rooted trees)
-        max_parts = (sum(1 for p in edges1 if len(p) > 1) +
-                     sum(1 for p in edges2 if len(p) > 1) - 2)
+        # the edge sets contain neither the root nor singleton partitions,
+        # i.e. every edge is a valid partition
+        max_parts = len(edges1) + len(edges2)
 
         min_comparison = (rf, max_parts, edges1, edges2)
 
@@ -366,54 +411,51 @@ class TreeNode(object):
         to work as a cache for operations that require many traversal
         operations.
 
+        The content is collected in a single iterative postorder pass,
+        the content of a node is the union of the content of its children.
+
         :param None store_attr: Specifies the node attribute that
             should be cached (i.e. name, distance, etc.). When none,
             the whole node instance is cached.
 
+        :param set container_type: Either set or list, the container
+            used for the content of each node.
+
+        :param True leaves_only: If False, the content of internal
+            nodes is cached as well.
+
         :param _store: (internal use)
         """
 
         if _store is None:
             _store = {}
 
-        def get_value(_n):
-            if store_attr is None:
-                _val = [_n]
-            else:
-                if not isinstance(store_attr, str):
-                    _val = [tuple(getattr(_n, attr, None) for attr in store_attr)]
-
+        # the value extractor and the container method are chosen once for all nodes
+        if store_attr is None:
+            def get_value(_n):
+                return _n
+        elif isinstance(store_attr, str):
+            def get_value(_n):
+                return getattr(_n, store_attr, None)
+        else:
+            def get_value(_n):
+                return tuple(getattr(_n, attr, None) for attr in store_attr)
+        add_all = set.update if container_type is set else list.extend
+
+        for node in self._iter_descendants_postorder():
+            if node.children:
+                if leaves_only:
+                    val = container_type()
+                    for ch in node.children:
+                        add_all(val, _store[ch])
                 else:
-                    _val = [getattr(_n, store_attr, None)]
-
-            return _val
-
-        for ch in self.children:
-            ch.get_cached_content(store_attr=store_attr,
-                                  container_type=container_type,
-                                  leaves_only=leaves_only,
-                                  _store=_store)
-
-        if self.children:
-            if not leaves_only:
-                val = container_type(get_value(self))
+                    val = container_type([get_value(node)])
+                    for ch in node.children:
+                        add_all(val, _store[ch])
+                        add_all(val, [get_value(ch)])
+                _store[node] = val
             else:
-                val = container_type()
-            for ch in self.children:
-                if type(val) == list:
-                    val.extend(_store[ch])
-                if type(val) == set:
-                    val.update(_store[ch])
-
-                if not leaves_only:
-                    if type(val) == list:
-                        val.extend(get_value(ch))
-                    if type(val) == set:
-                        val.update(get_value(ch))
-
-            _store[self] = val
-        else:
-            _store[self] = container_type(get_value(self))
+                _store[node] = container_type([get_value(node)])
 
         return _store
 
@@ -456,35 +498,31 @@ class TreeNode(object):
                 # the target_node provided
                 target_nodes = [target_nodes, self]
 
-        n2path = {}
-        reference = []
-        ref_node = None
+        # path of every target from the root down to the target, i.e. path[d] is its ancestor at
+        # depth d, targets given more than once share one path
+        root_paths = {}
         for n in target_nodes:
+            path = []
             current = n
-            while current:
-                n2path.setdefault(n, set()).add(current)
-                if not ref_node:
-                    reference.append(current)
+            while current is not None:
+                path.append(current)
                 current = current.up
-            if not ref_node:
-                ref_node = n
+            path.reverse()
+            root_paths[n] = path
 
+        # the common ancestor is the deepest depth at which all paths pass through the same node
+        paths = list(root_paths.values())
         common = None
-        for n in reference:
-            broken = False
-            for node, path in n2path.items():
-                if node is not ref_node and n not in path:
-                    broken = True
-                    break
-
-            if not broken:
-                common = n
+        for depth in range(min((len(p) for p in paths), default=0) - 1, -1, -1):
+            candidate = paths[0][depth]
+            if all(p[depth] is candidate for p in paths):
+                common = candidate
                 break
-        if not common:
+        if common is None:
             raise TreeError("Nodes are not connected!")
 
         if get_path:
-            return common, n2path
+            return common, {n: set(path) for n, path in root_paths.items()}
         else:
             return common
 
@@ -501,7 +539,7 @@ class TreeNode(object):
         """
         Return True if current node is a leaf.
         """
-        return len(self.children) == 0
+        return not self._children
 
     def is_root(self):
         """
@@ -561,21 +599,44 @@ class TreeNode(object):
             return nw
 
 
-def extract_edge_set(t, attr_t):
-    t_content = t.get_cached_content()
+def extract_edge_set(t, attr_t, taxon_id, new_taxa=False):
+    """
+    Returns the edges of a tree as bitmasks of taxon ids (bit i is set if the
+    taxon with id i is below the edge), skipping the root and singleton
+    partitions as they are present in every tree on the same taxa.
+    The taxa of the tree are collected in the same postorder walk.
+
+    :param t: The tree
+    :param attr_t: Leaf attribute used as the taxon name
+    :param taxon_id: Map from taxon name to its integer id
+    :param new_taxa: If True, taxa missing from taxon_id are added with the next free id,
+                     otherwise they raise a KeyError
+    :return: Set of edges and the bitmask of all taxa of the tree
+    """
+    if new_taxa:
+        def get_id(name):
+            return taxon_id.setdefault(name, len(taxon_id))
+    else:
+        get_id = taxon_id.__getitem__
+    name_of = operator.attrgetter(attr_t)
+    masks = {}
     edges = set()
-    for content in t_content.values():
-        edge = tuple(sorted(
-            getattr(n, attr_t)
-            for n in content
-        ))
-        if edge:
-            edges.add(edge)
-    return edges
+    for node in t.traverse("postorder"):
+        if node.children:
+            mask = 0
+            for ch in node.children:
+                mask |= masks[ch]
+            if node is not t and mask.bit_count() > 1:
+                edges.add(mask)
+        else:
+            mask = 1 << get_id(name_of(node))
+        masks[node] = mask
+    return edges, masks[t]
 
 
 def _translate_nodes(root, *nodes):
-    name2node = dict([[n, None] for n in nodes if type(n) is str])
+    # all names are resolved in a single traversal, nodes given as instances need none
+    name2node = dict.fromkeys(n for n in nodes if type(n) is str)
     if name2node:
         for n in root.traverse():
             if n.name in name2node:
@@ -584,7 +645,7 @@ def _translate_nodes(root, *nodes):
                 else:
                     name2node[n.name] = n
 
-    if None in list(name2node.values()):
+    if None in name2node.values():
         notfound = [key for key, value in name2node.items() if value is None]
         raise ValueError("Node names not found: " + str(notfound))
 
@@ -596,7 +657,7 @@ def _translate_nodes(root, *nodes):
             else:
                 valid_nodes.append(n)
 
-    valid_nodes.extend(list(name2node.values()))
+    valid_nodes.extend(name2node.values())
     if len(valid_nodes) == 1:
         return valid_nodes[0]
     else:
@@ -690,7 +751,12 @@ NW_FORMAT = {
 }
 
 
+@functools.lru_cache(maxsize=None)
 def compile_matchers(formatcode):
+    """
+    Returns the compiled node data matchers of a Newick format, built once per format code.
+    The returned dictionary is shared between calls and must not be modified.
+    """
     matchers = {}
     for node_type in ["leaf", "single", "internal"]:
         if node_type == "leaf" or node_type == "single":
@@ -729,7 +795,9 @@ def compile_matchers(formatcode):
 
         matcher_str = r'^\s*%s\s*%s\s*(%s)?\s*$' % (FIRST_MATCH, SECOND_MATCH, _NHX_RE)
         compiled_matcher = re.compile(matcher_str)
-        matchers[node_type] = [container1, container2, converterFn1, converterFn2, compiled_matcher]
+        optional1 = flexible1 and node_type != 'leaf'
+        matchers[node_type] = [container1, container2, converterFn1, converterFn2, compiled_matcher,
+                               optional1, flexible2]
 
     return matchers
 
@@ -740,17 +808,19 @@ def _read_newick_from_string(nw, root_node, matcher, formatcode, quoted_names):
     if quoted_names:
         # Quoted text is mapped to references
         quoted_map = {}
-        unquoted_nw = ''
-        counter = 0
-        for token in re.split(_QUOTED_TEXT_RE, nw):
-            counter += 1
-            if counter % 2 == 1:  # normal newick tree structure data
-                unquoted_nw += token
-            else:  # quoted text, add to dictionary and replace with reference
-                quoted_ref_id = _QUOTED_TEXT_PREFIX + str(int(counter / 2))
-                unquoted_nw += quoted_ref_id
-                quoted_map[quoted_ref_id] = token[1:-1]  # without the quotes
-        nw = unquoted_nw
+        # pieces of the unquoted string, joined once instead of growing a string per token
+        unquoted_parts = []
+        start = 0
+        for counter, quoted in enumerate(_QUOTED_TEXT_MATCHER.finditer(nw), start=1):
+            # normal newick tree structure data
+            unquoted_parts.append(nw[start:quoted.start()])
+            # quoted text, add to dictionary and replace with reference
+            quoted_ref_id = _QUOTED_TEXT_PREFIX + str(counter)
+            unquoted_parts.append(quoted_ref_id)
+            quoted_map[quoted_ref_id] = quoted.group()[1:-1]  # without the quotes
+            start = quoted.end()
+        unquoted_parts.append(nw[start:])
+        nw = "".join(unquoted_parts)
 
     if not nw.startswith('(') and nw.endswith(';'):
         _read_node_data(nw[:-1], root_node, "single", matcher, format)
@@ -763,51 +833,46 @@ def _read_newick_from_string(nw, root_node, matcher, formatcode, quoted_names):
         raise NewickError('Parentheses do not match. Broken tree structure?')
 
     # white spaces and separators are removed
-    nw = re.sub("[\n\r\t]+", "", nw)
+    nw = nw.translate(_NEWICK_WHITESPACE_TABLE)
 
     current_parent = None
-    # Each chunk represents the content of a parent node, and it could contain
-    # leaves and closing parentheses.
-    # We may find:
-    # leaf, ..., leaf,
-    # leaf, ..., leaf))),
-    # leaf)), leaf, leaf))
-    # leaf))
-    # ) only if formatcode == 100
-
-    for chunk in nw.split("(")[1:]:
-        # If no node has been created so far, this is the root, so use the node.
-        current_parent = root_node if current_parent is None else current_parent.add_child()
-
-        subchunks = [ch.strip() for ch in chunk.split(",")]
-        # We should expect that the chunk finished with a comma (if next chunk
-        # is an internal sister node) or a subchunk containing closing parenthesis
-        # until the end of the tree.
-        # [leaf, leaf, '']
-        # [leaf, leaf, ')))', leaf, leaf, '']
-        # [leaf, leaf, ')))', leaf, leaf, '']
-        # [leaf, leaf, ')))', leaf), leaf, 'leaf);']
-        if subchunks[-1] != '' and not subchunks[-1].endswith(';'):
-            raise NewickError('Broken newick structure at: %s' % chunk)
-
-        # lets process the subchunks. Every closing parenthesis will close a
-        # node and go up one level.
-        for i, leaf in enumerate(subchunks):
-            if leaf.strip() == '' and i == len(subchunks) - 1:
-                continue  # "blah blah ,( blah blah"
-            closing_nodes = leaf.split(")")
-
-            # first part after splitting by ) always contain leaf info
-            _read_node_data(closing_nodes[0], current_parent, "leaf", matcher, formatcode)
-
-            # next contain closing nodes and data about the internal nodes.
-            if len(closing_nodes) > 1:
-                for closing_internal in closing_nodes[1:]:
-                    closing_internal = closing_internal.rstrip(";")
-                    # read internal node data and go up one level
-                    _read_node_data(closing_internal, current_parent, "internal", matcher,
-                                    formatcode)
-                    current_parent = current_parent.up
+    # The string is scanned once for the structural characters, the text in between is node data:
+    # after "(" or "," up to the next "," or ")" it belongs to a leaf,
+    # after ")" up to the next "," or ")" (or the end) it belongs to the internal node just closed.
+    # A "(" opens a new internal node and may only follow "(" or "," without data in between.
+    prev_delim = None
+    start = 0
+    chunk_start = 0
+    for match in _NEWICK_STRUCTURE_RE.finditer(nw):
+        if current_parent is None and prev_delim is not None:
+            raise NewickError('Broken newick structure at: %s' % nw[chunk_start:match.end()])
+        delim = match.group()
+        segment = nw[start:match.start()]
+        start = match.end()
+
+        if delim == "(":
+            if prev_delim == ")" or segment.strip():
+                raise NewickError('Broken newick structure at: %s' % nw[chunk_start:match.start()])
+            chunk_start = start
+            # If no node has been created so far, this is the root, so use the node.
+            current_parent = root_node if current_parent is None else current_parent.add_child()
+        elif prev_delim == ")":
+            # read internal node data and go up one level
+            _read_node_data(segment.strip().rstrip(";"), current_parent, "internal", matcher,
+                            formatcode)
+            current_parent = current_parent.up
+        else:
+            _read_node_data(segment, current_parent, "leaf", matcher, formatcode)
+        prev_delim = delim
+
+    # the remaining data after the last structural character
+    segment = nw[start:].strip()
+    if prev_delim == ")":
+        _read_node_data(segment.rstrip(";"), current_parent, "internal", matcher, formatcode)
+    elif segment:
+        if current_parent is None or not segment.endswith(";"):
+            raise NewickError('Broken newick structure at: %s' % nw[chunk_start:])
+        _read_node_data(segment, current_parent, "leaf", matcher, formatcode)
 
     # references in node names are replaced with quoted text before returning
     if quoted_names:
@@ -818,47 +883,6 @@ def _read_newick_from_string(nw, root_node, matcher, formatcode, quoted_names):
     return root_node
 
 
-def _read_node_data(subnw, current_node, node_type, matcher, formatcode):
-    """ Reads a leaf node from a subpart of the original newick
-    tree """
-
-    if node_type == "leaf" or node_type == "single":
-        if node_type == "leaf":
-            node = current_node.add_child()
-        else:
-            node = current_node
-    else:
-        node = current_node
-
-    subnw = subnw.strip()
-
-    if not subnw and node_type == 'leaf' and formatcode != 100:
-        raise NewickError('Empty leaf node found')
-    elif not subnw:
-        return
-
-    container1, container2, converterFn1, converterFn2, compiled_matcher = matcher[node_type]
-    data = re.match(compiled_matcher, subnw)
-    if data:
-        data = data.groups()
-        # This prevents ignoring errors even in flexible nodes:
-        if subnw and data[0] is None and data[1] is None and data[2] is None:
-            raise NewickError("Unexpected newick format '%s'" % subnw)
-
-        if data[0] is not None and data[0] != '':
-            node.add_feature(container1, converterFn1(data[0].strip()))
-
-        if data[1] is not None and data[1] != '':
-            node.add_feature(container2, converterFn2(data[1][1:].strip()))
-
-        if data[2] is not None \
-                and data[2].startswith("[&&NHX"):
-            _parse_extra_features(node, data[2])
-    else:
-        raise NewickError("Unexpected newick format '%s' " % subnw[0:50])
-    return
-
-
 def _parse_extra_features(node, NHX_string):
     """ Reads node's extra data form its NHX string. NHX uses this
     format:  [&&NHX:prop1=value1:prop2=value2] """
@@ -891,28 +915,94 @@ def _read_node_data(subnw, current_node, node_type, matcher, formatcode):
     elif not subnw:
         return
 
-    container1, container2, converterFn1, converterFn2, compiled_matcher = matcher[node_type]
-    data = re.match(compiled_matcher, subnw)
+    container1, container2, converterFn1, converterFn2, compiled_matcher, optional1, optional2 = \
+        matcher[node_type]
+
+    fields = _split_node_data(subnw, converterFn1, converterFn2, optional1, optional2)
+    if fields is not None:
+        value1, value2 = fields
+        if value1 is not None:
+            node.add_feature(container1, value1)
+        if value2 is not None:
+            node.add_feature(container2, value2)
+        return
+
+    data = compiled_matcher.match(subnw)
     if data:
-        data = data.groups()
+        first, second, extra = data.groups()
         # This prevents ignoring errors even in flexible nodes:
-        if subnw and data[0] is None and data[1] is None and data[2] is None:
+        if subnw and first is None and second is None and extra is None:
             raise NewickError("Unexpected newick format '%s'" % subnw)
 
-        if data[0] is not None and data[0] != '':
-            node.add_feature(container1, converterFn1(data[0].strip()))
+        # groups are either None or str, so empty and missing groups are both skipped
+        if first:
+            node.add_feature(container1, _convert_matched_field(first.strip(), converterFn1))
 
-        if data[1] is not None and data[1] != '':
-            node.add_feature(container2, converterFn2(data[1][1:].strip()))
+        if second:
+            node.add_feature(container2, _convert_matched_field(second[1:].strip(), converterFn2))
 
-        if data[2] is not None \
-                and data[2].startswith("[&&NHX"):
-            _parse_extra_features(node, data[2])
+        if extra and extra.startswith("[&&NHX"):
+            _parse_extra_features(node, extra)
     else:
         raise NewickError("Unexpected newick format '%s' " % subnw[0:50])
     return
 
 
+def _split_node_data(subnw, converterFn1, converterFn2, optional1, optional2):
+    """ Splits and converts node data of the plain form first[:second], e.g. name:dist,
+    without the regex matcher. Returns None for anything else (NHX data, white space,
+    malformed values, ...) which is then left to the matcher. """
+    if converterFn1 is None or converterFn2 is None or _NODE_DATA_SPECIAL_RE.search(subnw):
+        return None
+
+    first, sep, second = subnw.partition(":")
+    if ":" in second:
+        return None
+
+    if first:
+        value1 = _convert_node_field(first, converterFn1)
+        if value1 is None:
+            return None
+    elif optional1:
+        value1 = None
+    else:
+        return None
+
+    if sep:
+        value2 = _convert_node_field(second, converterFn2)
+        if value2 is None:
+            return None
+    elif optional2:
+        value2 = None
+    else:
+        return None
+
+    return value1, value2
+
+
+def _convert_matched_field(field, converterFn):
+    """ Converts a node data field captured by the matcher, names are interned so that the same
+    taxon name in different trees is a single string object. """
+    if converterFn is str:
+        return sys.intern(field)
+    return converterFn(field)
+
+
+def _convert_node_field(field, converterFn):
+    """ Converts a single node data field, None if it does not match what the matcher accepts. """
+    if converterFn is str:
+        field = field.strip()
+        return sys.intern(field) if field else None
+    # float() also accepts e.g. '.5', 'inf' or '1_0', the matcher requires digits after the sign
+    start = 1 if field[:1] in ("+", "-") else 0
+    if not field[start:start + 1].isdigit() or not _FLOAT_CHARS.issuperset(field):
+        return None
+    try:
+        return converterFn(field)
+    except ValueError:
+        return None
+
+
 def format_node(node, node_type, format, dist_formatter=None,
                 support_formatter=None, name_formatter=None,
                 quoted_names=False):
@@ -920,24 +1010,34 @@ def format_node(node, node_type, format, dist_formatter=None,
     if support_formatter is None: support_formatter = FLOAT_FORMATTER
     if name_formatter is None: name_formatter = NAME_FORMATTER
 
+    return _format_node_data(node, _node_format_spec(format, node_type), dist_formatter,
+                             support_formatter, name_formatter, quoted_names)
+
+
+def _node_format_spec(format, node_type):
+    """
+    Returns container1, container2, converterFn1, converterFn2 and flexible1 of the given
+    node type in a Newick format, see :func:`_format_node_data`.
+    """
     if node_type == "leaf":
-        container1 = NW_FORMAT[format][0][0]  # name
-        container2 = NW_FORMAT[format][1][0]  # dists
-        converterFn1 = NW_FORMAT[format][0][1]
-        converterFn2 = NW_FORMAT[format][1][1]
-        flexible1 = NW_FORMAT[format][0][2]
+        first, second = NW_FORMAT[format][0], NW_FORMAT[format][1]  # name, dist
     else:
-        container1 = NW_FORMAT[format][2][0]  # support/name
-        container2 = NW_FORMAT[format][3][0]  # dist
-        converterFn1 = NW_FORMAT[format][2][1]
-        converterFn2 = NW_FORMAT[format][3][1]
-        flexible1 = NW_FORMAT[format][2][2]
+        first, second = NW_FORMAT[format][2], NW_FORMAT[format][3]  # support/name, dist
+    return first[0], second[0], first[1], second[1], first[2]
+
+
+def _format_node_data(node, spec, dist_formatter, support_formatter, name_formatter,
+                      quoted_names):
+    """
+    Formats the data of a node, with the format specification already resolved by
+    :func:`_node_format_spec` and the formatters resolved to their defaults.
+    """
+    container1, container2, converterFn1, converterFn2, flexible1 = spec
 
     if converterFn1 == str:
         try:
             if not quoted_names:
-                FIRST_PART = re.sub("[" + _ILEGAL_NEWICK_CHARS + "]", "_", \
-                                    str(getattr(node, container1)))
+                FIRST_PART = _ILEGAL_NEWICK_CHARS_RE.sub("_", str(getattr(node, container1)))
             else:
                 FIRST_PART = str(getattr(node, container1))
             if not FIRST_PART and container1 == 'name' and not flexible1:
@@ -961,8 +1061,7 @@ def format_node(node, node_type, format, dist_formatter=None,
 
     if converterFn2 == str:
         try:
-            SECOND_PART = ":" + re.sub("[" + _ILEGAL_NEWICK_CHARS + "]", "_", \
-                                       str(getattr(node, container2)))
+            SECOND_PART = ":" + _ILEGAL_NEWICK_CHARS_RE.sub("_", str(getattr(node, container2)))
         except (ValueError, TypeError):
             SECOND_PART = ":?"
     elif converterFn2 is None:
@@ -988,12 +1087,14 @@ def _get_features_string(self, features=None):
 
     parts = []
     for pr in features:
-        if not hasattr(self, pr):
+        raw = getattr(self, pr, _MISSING)
+        if raw is _MISSING:
             continue
 
-        raw = getattr(self, pr)
-
-        if isinstance(raw, dict):
+        # plain strings are the common case and need no conversion
+        if type(raw) is str:
+            pass
+        elif isinstance(raw, dict):
             raw = '|'.join(f"{k}-{v}" for k, v in raw.items())
         elif isinstance(raw, (list, tuple, set)):
             raw = '|'.join(map(str, raw))
@@ -1001,7 +1102,7 @@ def _get_features_string(self, features=None):
             raw = str(raw)
 
         # Replace illegal characters with "_"
-        sanitized = re.sub(rf"[{_ILEGAL_NEWICK_CHARS}]", "_", raw)
+        sanitized = _ILEGAL_NEWICK_CHARS_RE.sub("_", raw)
         parts.append(f"{pr}={sanitized}")
 
     return f"[&{','.join(parts)}]" if parts else ""
@@ -1015,30 +1116,34 @@ def write_newick(rootnode, features=None, format=1, format_root_node=True,
     representation.
     """
     newick = []
+    append = newick.append
     leaf = is_leaf_fn if is_leaf_fn else lambda n: not bool(n.children)
+    # the format is the same for all nodes, resolve it once instead of in every format_node call
+    if dist_formatter is None: dist_formatter = FLOAT_FORMATTER
+    if support_formatter is None: support_formatter = FLOAT_FORMATTER
+    if name_formatter is None: name_formatter = NAME_FORMATTER
+    leaf_spec = _node_format_spec(format, "leaf")
+    internal_spec = _node_format_spec(format, "internal")
     for postorder, node in rootnode.iter_prepostorder(is_leaf_fn=is_leaf_fn):
         if postorder:
-            newick.append(")")
+            append(")")
             if node.up is not None or format_root_node:
-                newick.append(format_node(node, "internal", format,
-                                          dist_formatter=dist_formatter,
-                                          support_formatter=support_formatter,
-                                          name_formatter=name_formatter,
-                                          quoted_names=quoted_names))
-                newick.append(_get_features_string(node, features))
+                append(_format_node_data(node, internal_spec, dist_formatter, support_formatter,
+                                         name_formatter, quoted_names))
+                # without requested features the NHX string is always empty
+                if features is not None:
+                    append(_get_features_string(node, features))
         else:
-            if node is not rootnode and node != node.up.children[0]:
-                newick.append(",")
+            if node is not rootnode and node is not node.up.children[0]:
+                append(",")
 
             if leaf(node):
-                newick.append(format_node(node, "leaf", format,
-                                          dist_formatter=dist_formatter,
-                                          support_formatter=support_formatter,
-                                          name_formatter=name_formatter,
-                                          quoted_names=quoted_names))
-                newick.append(_get_features_string(node, features))
+                append(_format_node_data(node, leaf_spec, dist_formatter, support_formatter,
+                                         name_formatter, quoted_names))
+                if features is not None:
+                    append(_get_features_string(node, features))
             else:
-                newick.append("(")
+                append("(")
 
     newick.append(";")
     return ''.join(newick)
@@ -1,16 +1,23 @@
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+from functools import partial
 
 import click
 import pandas as pd
 import datetime as dt
 
 from pyccd.read_nexus import read_nexus_trees
-from pyccd.find_infectors import find_infector_unknown, find_infector_with_data, find_infector
+from pyccd.find_infectors import (find_infector_unknown, find_infector_with_data, find_infector,
+                                  get_root_distances)
 
 global SCALE
 # Days per year, i.e. 1.0 float of branch length equals this value
 SCALE = 365.24219
+# columns of the infection events of a tree, see extracting_data
+EVENT_COLUMNS = ["Infector", "Infectee", "Infection Start", "Blockcount"]
+# number of trees handed to a worker process at once
+TREES_PER_TASK = 64
 
 
 def extract_date_from_label(taxon_label: str,
@@ -40,28 +47,33 @@ def extract_date_from_label(taxon_label: str,
                      f"Input for separation was '{sep}' and the date format was '{fmt}'.")
 
 
-def get_root_age_from_leafs(tree, taxon_map, sep, fmt):
-    root_node = tree.get_tree_root()
-    # scaling floats to dates
-    scaling_list = []
-    for l in tree:
-        cur_root_dist = l.get_distance(root_node)
-        cur_date = extract_date_from_label(taxon_map[int(l.name)], sep, fmt)
-        scaling_list.append((cur_root_dist, cur_date))
-
+def get_root_age_from_leafs(tree, taxon_map, sep, fmt, root_dist=None, leaf_dates=None):
+    if root_dist is None:
+        root_dist = get_root_distances(tree.get_tree_root())
+    if leaf_dates is None:
+        leaf_dates = {}
+    # scaling floats to dates, every leaf dates the root back by its distance to the root
     root_dates = []
-    for root_dist, date in scaling_list:
-        root_dates.append(date - timedelta(days=(root_dist * SCALE)))
-
-    unique_dates = sorted(set(root_dates))
-    if len(unique_dates) > 1:
-        diff_days = (unique_dates[-1] - unique_dates[0]).days
+    for l in tree:
+        cur_root_dist = root_dist[id(l)]
+        # the taxa are the same in all trees, their dates are parsed once and shared via leaf_dates
+        cur_date = leaf_dates.get(l.name)
+        if cur_date is None:
+            cur_date = extract_date_from_label(taxon_map[int(l.name)], sep, fmt)
+            leaf_dates[l.name] = cur_date
+        root_dates.append(cur_date - timedelta(days=(cur_root_dist * SCALE)))
+
+    # only the earliest and the latest root date matter
+    first_date = min(root_dates)
+    last_date = max(root_dates)
+    if first_date != last_date:
+        diff_days = (last_date - first_date).days
         if diff_days > 10:
-            print(f"Root date range: {unique_dates[0]} to {unique_dates[-1]}. ({diff_days} days)")
+            print(f"Root date range: {first_date} to {last_date}. ({diff_days} days)")
             raise ValueError("This is too much!?")
 
-    # print("Root date that will be used:", unique_dates[0])
-    return unique_dates[0]
+    # print("Root date that will be used:", first_date)
+    return first_date
 
 
 def float_to_date(root_date, float_val):
@@ -70,53 +82,55 @@ def float_to_date(root_date, float_val):
 
 
 def translate(value, taxon_map):
-    if str(value).startswith("Unknown"):
-        return str(value)
-    if str(value).startswith("block"):
-        return str(value)
+    label = str(value)
+    if label.startswith(("Unknown", "block")):
+        return label
     try:
         return taxon_map.get(int(value), "Unknown_?")
     except (ValueError, TypeError):
         return "Unknown_?"
 
 
-def extracting_data(tree, taxon_map, sep, fmt):
-    root_node = tree.get_tree_root()
+def extracting_data(tree, taxon_map, sep, fmt, leaf_dates=None):
+    return pd.DataFrame(extracting_events(tree, taxon_map, sep, fmt, leaf_dates),
+                        columns=EVENT_COLUMNS)
+
 
-    data_frame = []
+def extracting_events(tree, taxon_map, sep, fmt, leaf_dates=None):
+    root_dist = get_root_distances(tree.get_tree_root())
+
+    # todo not sure why some nodes are not unique but we can just remove the duplicate events....
+    # dict keys keep the first occurrence of each event tuple in insertion order
+    unique_data = {}
     unknown_nodes_todo = []
     seen_unknown_labels = set()
 
     for leaf in tree:
         og_infector = find_infector(leaf)
-        infector, cur_data, unknown_node = find_infector_with_data(leaf, root_node)
+        infector, cur_data, unknown_node = find_infector_with_data(leaf, root_dist=root_dist)
 
         if unknown_node is not None and unknown_node.transm_ancest not in seen_unknown_labels:
             unknown_nodes_todo.append(unknown_node)
             seen_unknown_labels.add(unknown_node.transm_ancest)
 
-        data_frame.extend(cur_data)
+        unique_data.update(dict.fromkeys(cur_data))
         if og_infector != infector:
             raise ValueError("This should not happen?!")
 
     for todo_node in unknown_nodes_todo:
         assert todo_node.transm_ancest.startswith("Unknown"), "Something went wrong!"
-        cur_data = find_infector_unknown(todo_node, root_node)
-        data_frame.extend(cur_data)
-
-    # print("-----")
-    # for i in data_frame:
-    #     print(i)
-    # print("-----")
-    # todo not sure why some nodes are not unique but we can just remove the duplicate events....
-    unique_data = [x for x in {tuple(sublist) for sublist in data_frame}]
+        cur_data = find_infector_unknown(todo_node, root_dist=root_dist)
+        unique_data.update(dict.fromkeys(cur_data))
 
     scaled_data_frame = []
-    root_date = get_root_age_from_leafs(tree, taxon_map, sep, fmt)
+    root_date = get_root_age_from_leafs(tree, taxon_map, sep, fmt, root_dist, leaf_dates)
+    # each label occurs in many events, translate every distinct one only once
+    labels = {label: translate(label, taxon_map)
+              for infector, infectee, _, _ in unique_data for label in (infector, infectee)}
     for infector, infectee, start, blockcount in unique_data:
         scaled_data_frame.append([
-            translate(infector, taxon_map),
-            translate(infectee, taxon_map),
+            labels[infector],
+            labels[infectee],
             float_to_date(root_date, start),
             # todo we can translate blockcount to three types of infection events...
             blockcount if blockcount else "NaN",
@@ -124,9 +138,26 @@ def extracting_data(tree, taxon_map, sep, fmt):
 
     # print(data_frame)
     # print(scaled_data_frame)
-    df = pd.DataFrame(scaled_data_frame, columns=["Infector", "Infectee", "Infection Start",
-                                                  "Blockcount"])
-    return df
+    return scaled_data_frame
+
+
+def extracting_events_of_trees(indexed_trees, taxon_map, sep, fmt):
+    """
+    Extracts the infection events of several trees, see :func:`extracting_events`.
+
+    :param indexed_trees: List of (tree index, tree) pairs
+    :param taxon_map: Dictionary mapping the taxon ids to their labels
+    :param sep: Separator of the date in the taxon labels
+    :param fmt: Format of the date in the taxon labels
+    :return: The events of all trees, each row ending with the index of its tree
+    """
+    rows = []
+    leaf_dates = {}
+    for i, tree in indexed_trees:
+        for event in extracting_events(tree, taxon_map, sep, fmt, leaf_dates):
+            event.append(i)  # add the tree index as a new column
+            rows.append(event)
+    return rows
 
 
 @click.command()
@@ -165,7 +196,14 @@ def extracting_data(tree, taxon_map, sep, fmt):
     show_default=True,
     help="Date format string to parse dates."
 )
-def main(trees_file, output, burn_in, date_sep, date_format):
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes extracting the infection events of the trees."
+)
+def main(trees_file, output, burn_in, date_sep, date_format, workers):
     trees, taxon_map = read_nexus_trees(
         trees_file,
         breath_trees=True,
@@ -177,17 +215,27 @@ def main(trees_file, output, burn_in, date_sep, date_format):
 
     click.echo(f"Parsed {len(trees)} trees.", err=True)
 
+    # the events of all trees are collected as rows and turned into a single DataFrame at the end
     all_results = []
-
-    with (click.progressbar(enumerate(trees, start=burnin_index),
-                            length=len(trees),
-                            label="Processing trees") as bar):
-        for i, tree in bar:
-            cur_df = extracting_data(tree, taxon_map, date_sep, date_format)
-            cur_df["tree_index"] = i  # add the tree index as a new column
-            all_results.append(cur_df)
-
-    final_df = pd.concat(all_results, ignore_index=True)
+    indexed_trees = list(enumerate(trees, start=burnin_index))
+    tasks = [indexed_trees[start:start + TREES_PER_TASK]
+             for start in range(0, len(indexed_trees), TREES_PER_TASK)]
+    extract = partial(extracting_events_of_trees, taxon_map=taxon_map, sep=date_sep,
+                      fmt=date_format)
+
+    with (click.progressbar(length=len(trees), label="Processing trees") as bar):
+        if workers > 1:
+            # the trees are independent, the results still come back in the order of the tasks
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for task, rows in zip(tasks, executor.map(extract, tasks)):
+                    all_results.extend(rows)
+                    bar.update(len(task))
+        else:
+            for task in tasks:
+                all_results.extend(extract(task))
+                bar.update(len(task))
+
+    final_df = pd.DataFrame(all_results, columns=EVENT_COLUMNS + ["tree_index"])
 
     if output:
         final_df.to_csv(output, index=False)
@@ -0,0 +1,43 @@
+"""
+Tests for the label_transmission_history.py functions
+"""
+from pyccd.label_transmission_history import label_transmission_tree
+from pyccd.tree import Tree
+
+
+def _remaining_unknowns_tree():
+    """
+    Small tree without leaves of blockcount -1, such that S1, S2, n1 and n2 are only labeled
+    by the last pass. In levelorder n1 comes before its still unlabeled blockcount -1 sibling S1,
+    while n2 comes after its blockcount -1 sibling S2, which is then already labeled.
+    """
+    tree = Tree("((n1,(a,b)S1)P1,((c,d)S2,n2)P2)R;", format=1)
+    blockcounts = {"P1": 1, "P2": 1, "S1": -1, "S2": -1, "n1": 0, "n2": 0,
+                   "a": 1, "b": 1, "c": 1, "d": 1}
+    for node in tree.traverse():
+        if node.name in blockcounts:
+            node.add_feature("blockcount", blockcounts[node.name])
+    return tree
+
+
+def test_label_remaining_unknowns_siblings():
+    """
+    Testing that the last labeling pass reuses the label of a sibling with blockcount -1 and
+    only draws one new unknown label for an unlabeled sibling with blockcount -1
+    """
+    tree = _remaining_unknowns_tree()
+    label_transmission_tree(tree)
+    assert {node.name: node.transm_ancest for node in tree.traverse()} == {
+        "R": "Unknown-6", "P1": "Unknown-0", "P2": "Unknown-1",
+        "n1": "Unknown-7", "S1": "Unknown-7", "S2": "Unknown-8", "n2": "Unknown-8",
+        "a": "Unknown-2", "b": "Unknown-3", "c": "Unknown-4", "d": "Unknown-5",
+    }
+
+
+def test_label_remaining_unknowns_num_unknowns():
+    """
+    Testing that num_unknowns counts all unknown labels, including those of the last labeling pass
+    """
+    tree = _remaining_unknowns_tree()
+    label_transmission_tree(tree)
+    assert tree.num_unknowns == 9
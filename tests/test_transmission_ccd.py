@@ -1,9 +1,22 @@
 """
 Tests for the transmission_ccd.py functions
 """
+from pathlib import Path
+
 import pytest
 
-from pyccd.transmission_ccd import TypeCCD, get_transmission_maps
+from pyccd.read_nexus import read_nexus_trees
+from pyccd.transmission_ccd import (TransmissionBlockClade, TypeCCD,
+                                    get_transmission_ccd_tree_bottom_up, get_transmission_maps)
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _block_clade(clade, has_block):
+    """
+    Shorthand for a TransmissionBlockClade of the given leaves
+    """
+    return TransmissionBlockClade(frozenset(clade), has_block)
 
 
 def test_valid_enum():
@@ -29,3 +42,49 @@ def test_get_transmission_maps_wrong_enum_conversion():
     with pytest.raises(ValueError) as e:
         get_transmission_maps(trees=[], type_str="Bla")
     assert str(e.value).startswith("Type 'Bla' not recognized.")
+
+
+def test_get_transmission_maps_m2_grouped_by_parent():
+    """
+    Testing that m2 maps each parent clade to the counts of its (child0, child1) splits
+    """
+    trees = read_nexus_trees(str(DATA_DIR / "BREATH5taxa.trees"), breath_trees=True)
+    _, m2, _, _ = get_transmission_maps(trees, type_str="Blocks")
+    b = _block_clade
+    assert {parent: dict(splits) for parent, splits in m2.items()} == {
+        b({1, 2, 3, 4, 5}, False): {(b({1, 2, 3}, True), b({4, 5}, False)): 1,
+                                    (b({1, 2, 3}, True), b({4, 5}, True)): 1},
+        b({4, 5}, False): {(b({4}, False), b({5}, True)): 1},
+        b({4, 5}, True): {(b({4}, True), b({5}, False)): 1},
+        b({1, 2, 3}, True): {(b({1, 2}, True), b({3}, False)): 2},
+        b({1, 2}, True): {(b({1}, False), b({2}, True)): 1,
+                          (b({1}, True), b({2}, True)): 1},
+    }
+
+
+@pytest.mark.parametrize("seed, expected_subtree", [
+    (0, "(4[&blockcount=0.0,&transmission.ancestor=None]:1.0,"
+        "5[&blockcount=-1,&transmission.ancestor=None]:1.0)"
+        "[&blockcount=4.0,&transmission.ancestor=None]:1.0"),
+    (1, "(4[&blockcount=-1,&transmission.ancestor=None]:1.0,"
+        "5[&blockcount=0.0,&transmission.ancestor=None]:1.0)"
+        "[&blockcount=-1,&transmission.ancestor=None]:1.0"),
+])
+def test_get_transmission_ccd_tree_bottom_up_seeded_ties(seed, expected_subtree):
+    """
+    Testing that the seed decides the tied root split of the MAP tree on BREATH5taxa.trees
+    """
+    trees = read_nexus_trees(str(DATA_DIR / "BREATH5taxa.trees"), breath_trees=True)
+    maps = get_transmission_maps(trees, type_str="Blocks")
+    with pytest.warns(UserWarning, match="Tie breaking affected"):
+        newick = get_transmission_ccd_tree_bottom_up(*maps, seed=seed)
+    assert newick == (
+        "((("
+        "1[&blockcount=-1,&transmission.ancestor=None]:1.0,"
+        "2[&blockcount=0.0,&transmission.ancestor=None]:1.0)"
+        "[&blockcount=1.5,&transmission.ancestor=None]:1.0,"
+        "3[&blockcount=-1,&transmission.ancestor=None]:1.0)"
+        "[&blockcount=0.0,&transmission.ancestor=None]:1.0,"
+        f"{expected_subtree})"
+        "[&blockcount=-1,&transmission.ancestor=None]:1.0"
+    )
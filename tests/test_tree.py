@@ -0,0 +1,15 @@
+"""
+Tests for the tree.py functions
+"""
+import pytest
+
+from pyccd.tree import NewickError, Tree
+
+
+@pytest.mark.parametrize("newick", ["A1(;", ",;", "b(1e-3;", "A1);"])
+def test_single_node_malformed_newick(newick):
+    """
+    Testing that malformed single node newick strings raise a NewickError
+    """
+    with pytest.raises(NewickError):
+        Tree(newick)